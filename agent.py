@@ -1,99 +1,580 @@
 import os
-import json
+import copy
+import time
+import uuid
+import functools
+import contextlib
 import asyncio
 import datetime
-from playwright.async_api import async_playwright
-import google.generativeai as genai
-from utils import resize_image, add_grid, mark_click, SYSTEM_PROMPT
+from utils import Frame, thumbprint_changes, SYSTEM_PROMPT, DOM_RULES, ZOOM_RULES, ZOOM_PROMPT, FAN_OUT_RULES
+from model_client import gemini_client, preload_sdk, prompt_bytes, chunk_text
+from rate_limit import RateLimitExceeded
+from journal import RunJournal
+from artifacts import ArtifactWriter, CapturePolicy, shared_store
+from step_cache import StepCache
+from settle import PageSettler
+from frame_policy import FramePolicy
+from dom_index import ElementIndex
+from frame_source import frame_source as make_frame_source
+from metrics import metrics
+from trajectory import TrajectoryStore, checkpoint_matches, final_answer
+from stream_parser import ActionParser
+from history import compact_step, describe_outcome, encode_history
+from reply import PARSE_OUTCOMES, ReplyError, POINT_CONFIG, repair_json, normalize_action, normalize_reply, repair_prompt
 from dotenv import load_dotenv
 
 # Silence GRPC and ABSL logs to prevent confusing error messages
 os.environ["GRPC_VERBOSITY"] = "ERROR"
 os.environ["GLOG_minloglevel"] = "2"
 
+def _decode_frame(raw, frame_settings, encode_grid):
+    """Runs on a worker thread: decodes a capture and, if asked, encodes the grid view the model will get."""
+    frame = Frame(raw, *frame_settings)
+    if encode_grid:
+        frame.grid_jpeg # Memoized on the frame
+    return frame
+
+def action_list(res_json):
+    """The reply's actions, accepting both the 'actions' list and the single 'action' form."""
+    actions = res_json.get("actions", [])
+    if not actions and res_json.get("action"):
+        actions = [{"action": res_json.get("action"), "params": res_json.get("params", [])}]
+    return actions
+
+async def listed_actions(actions):
+    """Yields (index, action) like a streamed reply, for decisions that are already complete."""
+    for pair in enumerate(actions):
+        yield pair
+
 class WebAgent:
-    def __init__(self, api_key=None, model_name="gemini-3-flash-preview", logger=None): 
+    def __init__(self, api_key=None, model_name="gemini-3-flash-preview", logger=None, browser=None, session_id=None, debug_capture="full", settle_timeout=5.0,
+                 frame_policy="adaptive", zoom="auto", perception="screenshot",
+                 frame_source="screencast", headless=False, model=None, replay=True, streaming=True, fan_out=True, max_branches=4): 
         self.api_key = api_key
         self.model_name = model_name
-        self.model = None
+        # Any client with `async generate_content(prompt, on_retry=None, generation_config=None)`, e.g. a
+        # ModelClient around fake_model.FakeModel. Without one, a Gemini client
+        # is built from the API key on the first run.
+        self.model = model
+        self.custom_model = model is not None
+        # Stream replies and start each action as soon as it has arrived
+        # (only with clients that have stream_content(), like ModelClient)
+        self.streaming = streaming
         self.history = []
         self.user_data_dir = os.path.join(os.getcwd(), "browser_profile")
-        self.session_file = os.path.join(self.user_data_dir, "last_url.txt")
-        self.logger = logger # Callback for status updates
+        self.session_id = session_id
+        session_name = "last_url.txt" if session_id is None else f"last_url_{session_id}.txt"
+        self.session_file = os.path.join(self.user_data_dir, session_name)
+        self.logger = logger # Non-blocking callback(message, type) for status updates
+        self.on_timing = None # Optional non-blocking callback(step, stages, total) after each step
+        self.on_frame = None # Optional non-blocking callback(frame) for each captured frame, e.g. a live view
         self.paused = False
         self.stopped = False
+        self._model_task = None # In-flight model request, cancelled on stop
+        self.step_cache = StepCache()
+        # Successful runs are recorded and replayed without the model while
+        # the page still matches them (see trajectory.py)
+        self.trajectories = TrajectoryStore(os.path.join(os.getcwd(), "trajectories")) if replay else None
+        self._trajectory = []
+        self.parse_stats = dict.fromkeys(PARSE_OUTCOMES, 0)
+        self.cache_stats = {"hits": 0, "misses": 0}
+        self.settler = PageSettler(timeout=settle_timeout)
+        # Where frames come from: "screencast" (CDP stream, latest frame
+        # buffered) or "screenshot" (page.screenshot() per step)
+        self.frames = make_frame_source(frame_source)
+        self.settler.frames = self.frames
+
+        # Perception: per-step frame size/quality, and optional zoomed second
+        # pass ("auto" lets the model ask for one, "off" never does).
+        # perception is "screenshot" (gridded image only), "dom" (element list,
+        # image only as a fallback) or "hybrid" (both every step).
+        if perception not in ("screenshot", "dom", "hybrid"):
+            raise ValueError(f"Unknown perception mode: {perception}")
+        self.frame_policy = FramePolicy(frame_policy)
+        self.zoom = zoom
+        self.perception = perception
+        self.element_index = ElementIndex()
+        self.system_prompt = SYSTEM_PROMPT
+        if perception != "screenshot":
+            self.system_prompt += DOM_RULES
+        if zoom == "auto":
+            self.system_prompt += ZOOM_RULES
+        # split() runs independent subtasks in parallel tabs, at most
+        # max_branches at a time (see _fan_out); branches never split again
+        self.fan_out = fan_out
+        self.max_branches = max_branches
+        if fan_out:
+            self.system_prompt += FAN_OUT_RULES
+        self._branches = set() # Agents running split() subtasks
+        self.outcome = None
+        self.result = None # finish(answer) of the last run
+        self.step_usage = {"model_calls": 0, "bytes_sent": 0, "prompt_tokens": 0, "cached_tokens": 0}
+        self._background = set() # Post-step work overlapping the next step
+        self._step_timings = {"total": [], "post": []}
+        self.step_spans = {} # Seconds per stage of the current step (see metrics.py)
         
-        # Debug setup
-        self.run_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.debug_dir = os.path.join(os.getcwd(), "debug", f"run_{self.run_id}")
-        os.makedirs(self.debug_dir, exist_ok=True)
-        self._init_html_report()
+        # Debug setup, a fresh directory and journal per run (see _start_run).
+        # debug_capture is a CapturePolicy or a spec like "sampled:5".
+        if not isinstance(debug_capture, CapturePolicy):
+            debug_capture = CapturePolicy.parse(debug_capture)
+        self.capture = debug_capture
+        # Images go to the content-addressed store shared by all runs (see ArtifactStore)
+        self.writer = ArtifactWriter(store=shared_store(os.path.join(os.getcwd(), "debug", "artifacts")))
+        self.run_id = None
+        self.debug_dir = None
+        self.journal = None
 
-        # Browser state
+        # Browser state. With a shared browser (see AgentPool) the agent gets
+        # its own isolated context in it instead of the persistent profile.
+        self.browser = browser
+        self.headless = headless
+        self._browser_start = None # In-flight start_browser(), shared by concurrent callers
         self.playwright = None
         self.context = None
         self.page = None
 
     def log(self, message, type="info"):
         if self.logger:
-            asyncio.create_task(self.logger(message, type))
+            self.logger(message, type)
         print(f"[{type.upper()}] {message}")
 
-    def _init_html_report(self):
-        report_path = os.path.join(self.debug_dir, "report.html")
-        html = """
-        <html>
-        <head>
-            <title>Web Agent Debug Report</title>
-            <style>
-                body { font-family: sans-serif; background: #1a1a1a; color: #eee; padding: 20px; }
-                .step { border: 1px solid #444; margin-bottom: 30px; padding: 15px; border-radius: 8px; background: #2a2a2a; }
-                .thought { font-style: italic; color: #aaa; margin-bottom: 15px; }
-                .views { display: flex; gap: 20px; }
-                .view { flex: 1; }
-                img { width: 100%; border-radius: 4px; border: 1px solid #555; }
-                h3 { margin-top: 0; color: #00d4ff; }
-                .label { font-weight: bold; margin-bottom: 5px; }
-            </style>
-        </head>
-        <body>
-            <h1>Agent Run: """ + self.run_id + """</h1>
-            <div id="steps"></div>
-        </body>
-        </html>
-        """
-        with open(report_path, "w") as f:
-            f.write(html)
-
-    def _add_to_report(self, step, thought, ai_view_path, action_results=None):
-        report_path = os.path.join(self.debug_dir, "report.html")
-        with open(report_path, "r") as f:
-            content = f.read()
+    def stop(self):
+        """Stops the current run, cancelling any in-flight model request."""
+        self.stopped = True
+        if self._model_task and not self._model_task.done():
+            self._model_task.cancel()
+        for branch in self._branches:
+            branch.stop()
+
+    def pause(self):
+        """Pauses before the next action, in every parallel tab too."""
+        self.paused = True
+        for branch in self._branches:
+            branch.pause()
+
+    def resume(self):
+        self.paused = False
+        for branch in self._branches:
+            branch.resume()
+
+    def _on_retry(self, delay):
+        metrics.inc("model_retries")
+        self.log(f"Rate limit reached. Trying again in {delay:.1f}s", "warning")
+
+    async def _generate(self, prompt, generation_config=None, client=None):
+        """Runs one model request as a cancellable task, on `client` if given (e.g. one holding the prompt prefix)."""
+        options = {"generation_config": generation_config} if generation_config else {}
+        client = client or self.model
+        self._model_task = asyncio.ensure_future(client.generate_content(prompt, on_retry=self._on_retry, **options))
+        try:
+            with metrics.span("model", self.step_spans):
+                response = await self._model_task
+        finally:
+            self._model_task = None
+        self._count_usage(prompt, getattr(response, "usage_metadata", None))
+        return response
+
+    def _count_usage(self, prompt, usage):
+        sent = prompt_bytes(prompt)
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+        cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+        self.step_usage["model_calls"] += 1
+        self.step_usage["bytes_sent"] += sent
+        self.step_usage["prompt_tokens"] += prompt_tokens
+        self.step_usage["cached_tokens"] += cached_tokens
+        metrics.inc("model_calls")
+        metrics.inc("bytes_uploaded", sent)
+        metrics.inc("prompt_tokens", prompt_tokens)
+        metrics.inc("cached_tokens", cached_tokens)
+
+    async def _read_stream(self, prompt, parser, events, client):
+        """Feeds a streamed reply to the parser and queues each event it completes, then None."""
+        usage = None
+        try:
+            with metrics.span("model", self.step_spans):
+                async with contextlib.aclosing(client.stream_content(prompt, on_retry=self._on_retry)) as chunks:
+                    async for chunk in chunks:
+                        usage = getattr(chunk, "usage_metadata", None) or usage
+                        for event in parser.feed(chunk_text(chunk)):
+                            events.put_nowait(event)
+        finally:
+            events.put_nowait(None)
+        self._count_usage(prompt, usage)
+
+    async def _stream_actions(self, prompt, decision, client=None):
+        """Yields (index, action) as each action of the streamed reply arrives; `decision` collects the reply."""
+        try:
+            async for item in self._stream_attempts(prompt, decision, client):
+                yield item
+        finally:
+            if "response" not in decision and "t_first" in decision:
+                # Left before the reply was complete (finish, ask_user, pause):
+                # its actions were parsed as they arrived, so count that parse
+                self._count_parse("repaired" if decision.get("changed") else "clean")
+
+    async def _stream_attempts(self, prompt, decision, client):
+        for attempt in range(3):
+            parser = ActionParser()
+            events = asyncio.Queue()
+            reader = asyncio.ensure_future(self._read_stream(prompt, parser, events, client or self.model))
+            self._model_task = reader
+            try:
+                while True:
+                    event = await events.get()
+                    if event is None:
+                        break
+                    kind, value = event
+                    if kind == "thought":
+                        decision["thought"] = value
+                        self.log(f"AI Thought: {value}")
+                        continue
+                    action = normalize_action(value)
+                    if action is not value:
+                        decision["changed"] = True # Dropped or converted, as the full parse would
+                    if action is None:
+                        continue
+                    decision.setdefault("t_first", time.perf_counter())
+                    decision["actions"].append(action)
+                    yield len(decision["actions"]) - 1, action
+                await reader
+            except asyncio.CancelledError:
+                if not self.stopped:
+                    raise
+                return
+            except RateLimitExceeded as e:
+                metrics.inc("rate_limited")
+                self.log(f"{e} Stopping agent.", "error")
+                return
+            finally:
+                if not reader.done():
+                    reader.cancel()
+                self._model_task = None
+
+            if not parser.text.strip() and not decision["actions"]:
+                metrics.inc("empty_responses")
+                if attempt < 2:
+                    self.log(f"Empty response received. Retrying ({attempt + 1}/2)...", "warning")
+                    await asyncio.sleep(2)
+                    continue
+                self.log("Fatal Error: Could not get valid AI response. Stopping agent.", "error")
+                return
+
+            try:
+                response = self._parse_reply(parser.text)
+            except ReplyError as e:
+                if decision["actions"]:
+                    # Broken after some actions already ran; keep those
+                    self._count_parse("repaired")
+                    response = {"thought": decision.get("thought", "None"), "actions": list(decision["actions"])}
+                else:
+                    response = await self._reprompt(e, parser.text)
+                    if response is None:
+                        return
+            decision["response"] = response
+            if "thought" not in decision:
+                decision["thought"] = response.get("thought", "None")
+                self.log(f"AI Thought: {decision['thought']}")
+            # Whatever the incremental parser couldn't pick out, e.g. the single-action form
+            for action in action_list(response)[len(decision["actions"]):]:
+                decision.setdefault("t_first", time.perf_counter())
+                decision["actions"].append(action)
+                yield len(decision["actions"]) - 1, action
+            return
+
+    async def _refine_with_zoom(self, frame, act_obj, x_pct, y_pct):
+        """Second pass: asks for precise coordinates on a high-resolution close-up around (x, y)."""
+        # A 200x200 unit window (2x2 grid cells) centered on the first guess
+        x0 = min(max(x_pct - 100, 0), 800)
+        y0 = min(max(y_pct - 100, 0), 800)
+        closeup = await self._capture_closeup((x0, y0, x0 + 200, y0 + 200))
+        if closeup is None:
+            closeup = frame.crop((x0, y0, x0 + 200, y0 + 200))
+        target = act_obj.get("target") or f"the element at ({x_pct}, {y_pct})"
+        prompt = [
+            ZOOM_PROMPT.format(target=target),
+            {
+                "mime_type": "image/jpeg",
+                "data": closeup.grid_jpeg
+            },
+        ]
+        text = await self._request_text(prompt, POINT_CONFIG)
+        try:
+            res_json = repair_json(text)[0] if text else None
+        except ReplyError:
+            res_json = None
+        try:
+            x, y = float(res_json["x"]), float(res_json["y"])
+        except (TypeError, ValueError, KeyError):
+            x = y = None
+        if x is None or not (0 <= x <= 1000 and 0 <= y <= 1000):
+            self.log(f"Unusable zoom reply {text!r}, keeping the first guess.", "warning")
+            return x_pct, y_pct
+        # Map close-up coordinates back onto the full-screen 0-1000 scale
+        return x0 + round(x * 200 / 1000), y0 + round(y * 200 / 1000)
+
+    async def _capture_closeup(self, box):
+        """Screenshots the (x0, y0, x1, y1) region, in 0-1000 units, at device resolution, or None on failure."""
+        viewport = self.page.viewport_size or {"width": 1280, "height": 720}
+        x0, y0, x1, y1 = box
+        clip = {
+            "x": x0 * viewport["width"] / 1000,
+            "y": y0 * viewport["height"] / 1000,
+            "width": (x1 - x0) * viewport["width"] / 1000,
+            "height": (y1 - y0) * viewport["height"] / 1000,
+        }
+        try:
+            with metrics.span("screenshot", self.step_spans):
+                png = await self.page.screenshot(clip=clip)
+        except Exception as e:
+            self.log(f"Could not capture the close-up, cropping the frame instead: {e}", "warning")
+            return None
+        return await asyncio.to_thread(Frame.closeup, png)
+
+    async def _query_model(self, prompt, client=None):
+        """Asks the model for the next step. Returns the parsed reply, or None if the run should end."""
+        text = await self._request_text(prompt, client=client)
+        if text is None:
+            return None
+        try:
+            return self._parse_reply(text)
+        except ReplyError as e:
+            return await self._reprompt(e, text)
+
+    async def _request_text(self, prompt, generation_config=None, client=None):
+        """Sends one prompt and returns the reply text, or None if the run should end."""
+        # Get response from Gemini, retrying empty responses (rate limits are
+        # retried by the model client and the shared limiter)
+        response = None
+        empty_retries = 0
+        while True:
+            if self.stopped:
+                break
+            try:
+                response = await self._generate(prompt, generation_config, client)
+                
+                # Check for empty response
+                if not response or not response.candidates or not response.candidates[0].content.parts:
+                    metrics.inc("empty_responses")
+                    if empty_retries < 2:
+                        empty_retries += 1
+                        self.log(f"Empty response received. Retrying ({empty_retries}/2)...", "warning")
+                        await asyncio.sleep(2)
+                        continue
+                    else:
+                        self.log("AI returned empty content after retries.", "error")
+                        break
+                
+                break
+            except asyncio.CancelledError:
+                if not self.stopped:
+                    raise
+                response = None
+                break
+            except RateLimitExceeded as e:
+                metrics.inc("rate_limited")
+                self.log(f"{e} Stopping agent.", "error")
+                return None
         
-        actions_html = ""
-        if action_results:
-            for i, res_path in enumerate(action_results):
-                actions_html += f'<div class="view"><div class="label">Action {i} Verification</div><img src="{os.path.basename(res_path)}"></div>'
-
-        new_step = f"""
-        <div class="step">
-            <h3>Step {step}</h3>
-            <div class="thought"><b>Thought:</b> {thought}</div>
-            <div class="views">
-                <div class="view"><div class="label">AI View (Grid Version)</div><img src="{os.path.basename(ai_view_path)}"></div>
-                {actions_html}
-            </div>
-        </div>
-        """
-        content = content.replace('<div id="steps"></div>', new_step + '<div id="steps"></div>')
-        with open(report_path, "w") as f:
-            f.write(content)
+        if self.stopped:
+            return None
+
+        if not response or not response.candidates or not response.candidates[0].content.parts:
+            self.log("Fatal Error: Could not get valid AI response. Stopping agent.", "error")
+            return None
+            
+        return response.text
+
+    def _parse_reply(self, text, count=True):
+        """Repairs and normalizes a step reply; raises ReplyError if it can't be used."""
+        with metrics.span("parse", self.step_spans):
+            value, outcome = repair_json(text)
+            reply, changed = normalize_reply(value)
+        if count:
+            self._count_parse("repaired" if changed else outcome)
+        return reply
+
+    def _count_parse(self, outcome):
+        self.parse_stats[outcome] += 1
+        metrics.inc("parse_failures" if outcome == "failed" else f"parse_{outcome}")
+
+    async def _reprompt(self, error, text, attempts=2):
+        """Asks again, text only, for a reply that could not be used instead of ending the run."""
+        for attempt in range(attempts):
+            self.log(f"Unusable AI response ({error}). Asking again ({attempt + 1}/{attempts})...", "warning")
+            text = await self._request_text([repair_prompt(error, text)])
+            if text is None:
+                return None
+            try:
+                reply = self._parse_reply(text, count=False)
+            except ReplyError as e:
+                error = e
+                continue
+            self._count_parse("reprompted")
+            return reply
+        self._count_parse("failed")
+        self.log(f"AI response format error: {error}", "error")
+        return None
+
+    def _start_run(self):
+        self.run_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + "_" + uuid.uuid4().hex[:4]
+        self.debug_dir = None
+        if self.capture.enabled:
+            self.debug_dir = os.path.join(os.getcwd(), "debug", f"run_{self.run_id}")
+            os.makedirs(self.debug_dir, exist_ok=True)
+        self.journal = RunJournal(self.debug_dir, self.run_id)
+        self.cache_stats = {"hits": 0, "misses": 0}
+        self.step_cache.clear() # Decisions never carry over to another run or user
+        self.settler.stats = {}
+        self._step_timings = {"total": [], "post": []}
+        self._trajectory = []
+        self.parse_stats = dict.fromkeys(PARSE_OUTCOMES, 0)
+        self.outcome = None
+        self.result = None
+
+    def _spawn(self, coro):
+        """Runs post-step work in the background; run() waits for it at the end."""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _capture_frame(self, spans):
+        """Reads the next frame and decodes it off the event loop, timing both into `spans`."""
+        frame_settings = self.frame_policy.settings()
+        with metrics.span("screenshot", spans):
+            await self.frames.ensure(self.page)
+            self.frames.configure(*frame_settings)
+            raw_screenshot = await self.frames.latest()
+        # Decode + resize once at the size the frame policy picks, and encode
+        # the grid view in the same worker call if the step will send it
+        with metrics.span("decode", spans):
+            frame = await asyncio.to_thread(_decode_frame, raw_screenshot, frame_settings, self.perception != "dom")
+        if self.on_frame:
+            self.on_frame(frame)
+        return frame, frame_settings
+
+    async def _capture_error(self, step, frame, error):
+        """Saves the frame the failing step was working on."""
+        if not frame or not self.debug_dir or not self.capture.capture_error():
+            return
+        artifact = await self.writer.store(lambda: frame.grid_jpeg)
+        await self.journal.append("error", step=step, error=error, artifact=await artifact)
+
+    def _record_step(self, step, thought, actions, ai_view, action_results, t_start, t_captured, t_model, cached, settle_times, frame_settings, prefetched,
+                     checkpoint, replayed):
+        """Closes the step's critical path and hands its bookkeeping to the background."""
+        t_end = time.perf_counter()
+        self._trajectory.append({"checkpoint": checkpoint, "response": copy.deepcopy({"thought": thought, "actions": actions})})
+        self._step_timings["total"].append(t_end - t_start)
+        if self.on_timing:
+            self.on_timing(step, dict(self.step_spans), t_end - t_start)
+        try:
+            url = self.page.url
+        except Exception:
+            url = None
+        event = dict(
+            step=step,
+            thought=thought,
+            actions=actions,
+            cache="hit" if cached else "miss",
+            replayed=replayed,
+            usage=dict(self.step_usage),
+            frame={"width": frame_settings[0], "quality": frame_settings[1]},
+            settle=settle_times,
+            prefetched=prefetched,
+            timings={
+                "capture": t_captured - t_start,
+                "model": t_model - t_captured,
+                "actions": t_end - t_model,
+                "total": t_end - t_start, # Critical path; post-step work is not included
+            },
+            artifacts={"ai_view": ai_view, "clicks": action_results}, # Store keys, once written
+        )
+        self._spawn(self._post_step(url, event))
+
+    async def _post_step(self, url, event):
+        """Persists the session URL and journals the step, concurrently with the next step."""
+        t_start = time.perf_counter()
+        with metrics.span("post"):
+            if url and self.session_file:
+                await self.writer.write(self.session_file, url.encode())
+        post = time.perf_counter() - t_start
+        self._step_timings["post"].append(post)
+        event["timings"]["post"] = post
+        artifacts = event["artifacts"]
+        if artifacts["ai_view"] is not None:
+            artifacts["ai_view"] = await artifacts["ai_view"]
+        artifacts["clicks"] = [await key for key in artifacts["clicks"]]
+        await self.journal.append("step", **event)
+
+    def _branch_agent(self, n):
+        """An agent like this one for a split() subtask; it shares the model client and so the rate limiter."""
+        prefix = f"[Tab {n}] "
+        logger = (lambda message, type="info": self.logger(prefix + message, type)) if self.logger else None
+        branch = WebAgent(model=self.model, model_name=self.model_name, logger=logger, debug_capture=self.capture,
+                          settle_timeout=self.settler.timeout, frame_policy=self.frame_policy.mode, zoom=self.zoom,
+                          perception=self.perception, frame_source="screenshot", replay=self.trajectories is not None,
+                          streaming=self.streaming, fan_out=False)
+        branch.session_file = None # Only the main tab is resumed next session
+        branch.writer = self.writer # One writer task for every tab; a branch's own would never be stopped
+        branch.paused = self.paused # A tab opened while paused starts paused
+        return branch
+
+    async def _fan_out(self, subtasks, task):
+        """Runs split() subtasks concurrently in new tabs and returns their answers, one line per subtask."""
+        start_url = self.page.url
+        slots = asyncio.Semaphore(self.max_branches)
+        t_start = time.perf_counter()
+
+        async def run_branch(n, subtask):
+            url, _, rest = subtask.partition(" ")
+            if not url.startswith("http"):
+                url, rest = start_url, subtask
+            async with slots:
+                if self.stopped:
+                    return {"task": subtask, "outcome": "stopped", "result": None, "seconds": 0.0}
+                branch = self._branch_agent(n)
+                self._branches.add(branch)
+                t_branch = time.perf_counter()
+                try:
+                    branch.context = self.context
+                    branch.page = await self.context.new_page()
+                    await branch.page.goto(url)
+                    await branch.run(f"{rest}\n(One part of the task: {task}. End with finish(answer) giving what you found.)")
+                    outcome = branch.outcome
+                except Exception as e:
+                    self.log(f"[Tab {n}] Error: {e}", "error")
+                    outcome = "error"
+                finally:
+                    self._branches.discard(branch)
+                    await branch.frames.stop()
+                    if branch.page and not branch.page.is_closed():
+                        await branch.page.close()
+                return {"task": subtask, "outcome": outcome, "result": branch.result, "seconds": time.perf_counter() - t_branch}
+
+        metrics.inc("branches", len(subtasks))
+        branches = await asyncio.gather(*(run_branch(n, subtask) for n, subtask in enumerate(subtasks, 1)))
+        await self.journal.append("fan_out", branches=branches, seconds=time.perf_counter() - t_start)
+        lines = []
+        for n, branch in enumerate(branches, 1):
+            answer = branch["result"] or f"no answer ({branch['outcome']})"
+            lines.append(f"tab {n}: {answer[:300]}")
+        return "; ".join(lines)
+
+    def _timing_summary(self):
+        """Mean critical-path and background post-step time per step."""
+        summary = {}
+        for name, values in self._step_timings.items():
+            summary[f"{name}_mean"] = sum(values) / len(values) if values else 0.0
+        summary["steps"] = len(self._step_timings["total"])
+        return summary
 
     async def start_browser(self, url=None):
         """Initializes the browser and persists the context."""
         if self.page:
             return
 
+        os.makedirs(self.user_data_dir, exist_ok=True)
+
         if not url:
             if os.path.exists(self.session_file):
                 with open(self.session_file, "r") as f:
@@ -104,19 +585,37 @@ class WebAgent:
 
         self.log(f"Starting browser at {url}...")
         
-        self.playwright = await async_playwright().start()
-        self.context = await self.playwright.chromium.launch_persistent_context(
-            self.user_data_dir,
-            channel="msedge",
-            headless=False,
-            viewport={'width': 1280, 'height': 720}
-        )
+        if self.browser:
+            self.context = await self.browser.new_context(viewport={'width': 1280, 'height': 720})
+        else:
+            from playwright.async_api import async_playwright # Deferred to keep server startup fast
+            self.playwright = await async_playwright().start()
+            self.context = await self.playwright.chromium.launch_persistent_context(
+                self.user_data_dir,
+                channel="msedge",
+                headless=self.headless,
+                viewport={'width': 1280, 'height': 720}
+            )
         self.page = self.context.pages[0] if self.context.pages else await self.context.new_page()
         await self.page.goto(url)
         self.log("Browser ready. Agent taking over.")
 
+    async def ensure_browser(self):
+        """Starts the browser unless it is already up, joining a launch that is already in progress."""
+        if self.page:
+            return
+        if not self._browser_start:
+            self._browser_start = asyncio.ensure_future(self.start_browser())
+        try:
+            # Shielded so a caller being cancelled doesn't abort a launch others wait on
+            await asyncio.shield(self._browser_start)
+        finally:
+            if self._browser_start and self._browser_start.done():
+                self._browser_start = None
+
     async def stop_browser(self):
         """Stops the browser and playwright."""
+        await self.frames.stop()
         if self.context:
             await self.context.close()
         if self.playwright:
@@ -128,25 +627,49 @@ class WebAgent:
     async def run(self, task, api_key=None):
         # Configure API key and model if provided or if not already set
         current_key = api_key or self.api_key
-        if not current_key:
+        if not current_key and not self.custom_model:
             self.log("No API key provided. Please enter your Gemini API key.", "error")
             return
 
-        if current_key != self.api_key or not self.model:
-            self.api_key = current_key
-            genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel(self.model_name)
+        # Set up the model client while the browser starts (or joins the
+        # pool's warm-up launch); the SDK import is the slow part of the former
+        async def setup_model():
+            await preload_sdk()
+            self.model = gemini_client(self.api_key, self.model_name)
 
-        # Ensure browser is started
-        if not self.page:
-            await self.start_browser()
+        setup = [self.ensure_browser()]
+        if not self.custom_model and (current_key != self.api_key or not self.model):
+            self.api_key = current_key
+            setup.append(setup_model())
+        await asyncio.gather(*setup)
 
+        self._start_run()
+        start_url = self.page.url
+        trajectory = None
+        if self.trajectories:
+            trajectory = await asyncio.to_thread(self.trajectories.load, task, start_url)
+        replay_steps = trajectory["steps"] if trajectory else None
+        await self.journal.append("run_start", task=task, run_id=self.run_id, replay=bool(replay_steps))
         self.log(f"Starting task: {task}")
+        outcome = "incomplete"
+        last_pointer_thumb = None # Frame thumbprint before the last click/type, to detect misses
+        last_url = last_thumb = None # Page the previous step acted on, for its history outcome
+        self.frame_policy.reset()
+        # Stable for the whole run, so clients that can hold it get it once
+        # (see ModelClient.with_prefix) and each step sends only what changed
+        prompt_prefix = f"{self.system_prompt}\nUser Task: {task}"
+        
+        prefetch = None # Next frame, captured speculatively once the last action settled
+        prefetch_spans = None
         
         try:
             for step in range(30): # Increased steps for longer tasks if needed
                 # Wait loop if paused
                 while self.paused and not self.stopped:
+                    if prefetch:
+                        # The page may change while paused, so the speculative frame is stale
+                        prefetch.cancel()
+                        prefetch = None
                     await asyncio.sleep(0.5)
                 
                 if self.stopped:
@@ -155,6 +678,9 @@ class WebAgent:
                     break
 
                 if self.page.is_closed():
+                    if prefetch:
+                        prefetch.cancel() # It was capturing the closed page
+                        prefetch = None
                     # Try to find another page if this one was closed
                     if self.context.pages:
                         self.page = self.context.pages[0]
@@ -164,151 +690,257 @@ class WebAgent:
                         break
 
                 try:
-                    # 1. Take a screenshot
+                    # 1. Take a screenshot (or pick up the one prefetched last step)
                     self.log(f"Step {step}: Analyzing screen...")
-                    raw_screenshot = await self.page.screenshot()
-                    
-                    # Process for AI (Resize + Grid)
-                    resized_screenshot = resize_image(raw_screenshot)
-                    grid_screenshot = add_grid(resized_screenshot)
-                    
-                    # Save original resized for marking
-                    debug_img = resized_screenshot
-                    
-                    prompt = [
-                        SYSTEM_PROMPT,
-                        f"User Task: {task}",
-                        f"History: {json.dumps(self.history[-3:])}", # Only send last 3 steps to save tokens
-                        {
-                            "mime_type": "image/jpeg",
-                            "data": grid_screenshot
-                        },
-                        "Respond in JSON. Be precise with coordinates using the grid."
-                    ]
-
-                    # 3. Get response from Gemini with Retry logic
-                    response = None
-                    max_retries = 10
-                    empty_retries = 0
-                    for attempt in range(max_retries):
-                        try:
-                            response = self.model.generate_content(prompt)
-                            
-                            # Check for empty response
-                            if not response or not response.candidates or not response.candidates[0].content.parts:
-                                if empty_retries < 2:
-                                    empty_retries += 1
-                                    self.log(f"Empty response received. Retrying ({empty_retries}/2)...", "warning")
-                                    await asyncio.sleep(2)
-                                    continue
-                                else:
-                                    self.log("AI returned empty content after retries.", "error")
-                                    break
-                            
-                            break
-                        except Exception as e:
-                            if "429" in str(e) or "ResourceExhausted" in str(e):
-                                wait_time = (2 ** attempt) + 3 # 4, 5, 7, 11, 19...
-                                self.log(f"Rate limit reached. Trying again in {wait_time}s", "warning")
-                                await asyncio.sleep(wait_time)
-                            else:
-                                raise e
-                    
-                    if not response or not response.candidates or not response.candidates[0].content.parts:
-                        if not self.stopped:
-                            self.log("Fatal Error: Could not get valid AI response. Stopping agent.", "error")
-                        break
-                        
-                    text = response.text.strip()
-                    if "```json" in text:
-                        text = text.split("```json")[-1].split("```")[0].strip()
-                    elif "```" in text:
-                        text = text.split("```")[-1].split("```")[0].strip()
-                    
-                    res_json = json.loads(text)
-                    self.history.append(res_json)
-                    self.history = self.history[-10:] # Keep only last 10 steps
-                    thought = res_json.get("thought", "None")
-                    self.log(f"AI Thought: {thought}")
-                    
-                    # Save session state (last URL)
-                    try:
-                        current_url = self.page.url
-                        with open(self.session_file, "w") as f:
-                            f.write(current_url)
-                    except:
-                        pass
-                    
-                    # Save what the AI SAW
-                    ai_view_path = os.path.join(self.debug_dir, f"step_{step}_ai.jpg")
-                    with open(ai_view_path, "wb") as f:
-                        f.write(grid_screenshot)
+                    t_start = time.perf_counter()
+                    frame = None
+                    action_source = None
+                    decision = None # Filled in while a streamed reply arrives
+                    prefetched = prefetch is not None
+                    self.step_spans = prefetch_spans if prefetched else {}
+                    metrics.inc("steps")
+                    if prefetch:
+                        frame, frame_settings = await prefetch
+                        prefetch = None
+                    else:
+                        frame, frame_settings = await self._capture_frame(self.step_spans)
+                    self.step_usage = {"model_calls": 0, "bytes_sent": 0, "prompt_tokens": 0, "cached_tokens": 0}
+                    t_captured = time.perf_counter()
+
+                    # 3. Get a decision: reuse one for an unchanged screen, else ask Gemini
+                    thumb = frame.thumbprint()
+                    # A click/type that left the screen unchanged likely missed: sharpen the next frame
+                    missed = last_pointer_thumb is not None and thumbprint_changes(last_pointer_thumb, thumb) == 0
+                    if last_pointer_thumb is not None:
+                        self.frame_policy.observe(not missed)
+                    last_pointer_thumb = None
+
+                    # What the previous step's actions did, shown in the history
+                    url = self.page.url
+                    if self.history and self.history[-1]["result"] is None:
+                        self.history[-1]["result"] = describe_outcome(last_url, url, last_thumb, thumb)
+                    last_url, last_thumb = url, thumb
 
-                    # Handle both single 'action' and multiple 'actions'
-                    actions = res_json.get("actions", [])
-                    if not actions and res_json.get("action"):
-                        actions = [{"action": res_json.get("action"), "params": res_json.get("params", [])}]
+                    if self.perception != "screenshot":
+                        with metrics.span("index", self.step_spans):
+                            await self.element_index.refresh(self.page)
+
+                    # Follow a recorded run of this task while the page still matches it
+                    checkpoint = {"url": url, "frame": thumb,
+                                  "dom": self.element_index.signature() if self.perception != "screenshot" else None}
+                    replayed = False
+                    if replay_steps and step < len(replay_steps) and final_answer(replay_steps[step]["response"]):
+                        # The answer may have changed since the recording; let the model give it
+                        self.log("Reached the recorded run's answer, asking the model for it.")
+                        replay_steps = None
+                    if replay_steps:
+                        if step < len(replay_steps) and checkpoint_matches(replay_steps[step]["checkpoint"], checkpoint):
+                            res_json = copy.deepcopy(replay_steps[step]["response"])
+                            replayed = True
+                            metrics.inc("replayed_steps")
+                            self.log("Page matches the recorded run, replaying its step.")
+                        else:
+                            metrics.inc("replay_divergences")
+                            self.log(f"Page no longer matches the recorded run at step {step}, asking the model from here.", "warning")
+                            replay_steps = None
+
+                    if replayed:
+                        cached = False
+                    else:
+                        res_json = self.step_cache.get(task, url, thumb, self.history)
+                        cached = res_json is not None
+                    if cached:
+                        self.cache_stats["hits"] += 1
+                        metrics.inc("cache_hits")
+                        self.log("Screen unchanged, reusing previous decision.")
+                    elif not replayed:
+                        self.cache_stats["misses"] += 1
+                        metrics.inc("cache_misses")
+                        prefixed = await self.model.with_prefix(prompt_prefix) if hasattr(self.model, "with_prefix") else None
+                        prompt = [] if prefixed else [self.system_prompt, f"User Task: {task}"]
+                        prompt.append(f"History (oldest first):\n{encode_history(self.history)}") # Last 3 steps, actions and outcomes only
+                        if self.perception != "screenshot":
+                            prompt.append(f"ELEMENTS:\n{self.element_index.describe()}")
+                        # In dom mode the screenshot is only a fallback: for pages with no
+                        # indexed elements, or after an action that didn't change anything
+                        if self.perception != "dom" or not self.element_index.elements or missed:
+                            with metrics.span("encode", self.step_spans):
+                                grid_jpeg = await asyncio.to_thread(getattr, frame, "grid_jpeg") # Usually done in _capture_frame
+                            prompt += [
+                                {
+                                    "mime_type": "image/jpeg",
+                                    "data": grid_jpeg
+                                },
+                                "Respond in JSON. Be precise with coordinates using the grid."
+                            ]
+                        else:
+                            prompt.append("No screenshot this step. Respond in JSON, targeting elements by id.")
+
+                        if self.streaming and hasattr(self.model, "stream_content"):
+                            # Actions start as each one streams in; the complete
+                            # reply is checked once the action loop is done
+                            decision = {"actions": []}
+                            action_source = self._stream_actions(prompt, decision, prefixed)
+                        else:
+                            res_json = await self._query_model(prompt, prefixed)
+
+                            if self.stopped:
+                                self.log("Agent stopped by user.", "warning")
+                                self.stopped = False
+                                break
+                            if res_json is None:
+                                break
+                            self.step_cache.put(task, url, thumb, self.history, res_json)
+
+                    if decision is None:
+                        t_model = time.perf_counter()
+                        actions = action_list(res_json)
+                        self.history.append(compact_step(actions))
+                        self.history = self.history[-10:] # Keep only last 10 steps
+                        thought = res_json.get("thought", "None")
+                        self.log(f"AI Thought: {thought}")
+                        action_source = listed_actions(actions)
+                    else:
+                        t_model = None
+                        thought = "None"
+                        actions = decision["actions"]
+                    
+                    # Save what the AI SAW, if this step is captured
+                    ai_view = None
+                    if self.debug_dir and self.capture.capture_step(step):
+                        ai_view = await self.writer.store(lambda frame=frame: frame.grid_jpeg)
 
                     action_results = []
-                    for i, act_obj in enumerate(actions):
-                        if self.paused or self.stopped: 
+                    settle_times = []
+                    branch_results = None
+                    left_early = False # The action loop ended before the reply did (ask_user, closed page)
+                    async for i, act_obj in action_source:
+                        if self.paused or self.stopped or self.page.is_closed():
+                            if decision is not None:
+                                decision["actions"].pop() # Yielded but not run, so not part of the step
+                            left_early = not (self.paused or self.stopped)
                             break
                         
-                        if self.page.is_closed(): break
-                        
                         action = act_obj.get("action")
                         params = act_obj.get("params", [])
+                        self.frames.mark_action() # Only frames painted after this show its effect
 
                         if action == "click" or action == "type" or action == "paste":
-                            if action == "click":
+                            # Element-id form, click(id) / type(text, id), from the ELEMENTS list
+                            if self.perception != "screenshot" and len(params) == (1 if action == "click" else 2):
+                                point = self.element_index.center(params[-1])
+                                if point is None:
+                                    self.log(f"Unknown element id {params[-1]}, skipping {action}.", "warning")
+                                    continue
+                                x_pct, y_pct = point
+                            elif action == "click":
                                 x_pct, y_pct = params[0], params[1]
                             else:
                                 x_pct, y_pct = params[1], params[2]
 
-                            # Save debug image
-                            marked_img = mark_click(debug_img, x_pct, y_pct)
-                            click_view_path = os.path.join(self.debug_dir, f"step_{step}_click_{i}.jpg")
-                            with open(click_view_path, "wb") as f:
-                                f.write(marked_img)
-                            action_results.append(click_view_path)
+                            if act_obj.get("refined"):
+                                # Zoomed coordinates kept from a recorded run
+                                x_pct, y_pct = act_obj["refined"]
+                            elif act_obj.get("zoom") and self.zoom == "auto":
+                                x_pct, y_pct = await self._refine_with_zoom(frame, act_obj, x_pct, y_pct)
+                                if self.stopped:
+                                    break
+                                act_obj["refined"] = [x_pct, y_pct]
+                            last_pointer_thumb = thumb
+
+                            # Save debug image (encoded by the writer, off the step path)
+                            if ai_view:
+                                action_results.append(await self.writer.store(functools.partial(frame.mark_click, x_pct, y_pct)))
                             self.log(f"Performing {action} at ({x_pct}, {y_pct}).")
                             
                             # Perform action
-                            await self.page.mouse.click(x_pct * 1280 / 1000, y_pct * 720 / 1000)
-                            if action == "type":
-                                await self.page.keyboard.type(params[0])
-                                await self.page.keyboard.press("Enter")
-                            elif action == "paste":
-                                await self.page.keyboard.insert_text(params[0])
-                                await self.page.keyboard.press("Enter")
+                            with metrics.span("actions", self.step_spans):
+                                await self.page.mouse.click(x_pct * 1280 / 1000, y_pct * 720 / 1000)
+                                if action == "type":
+                                    await self.page.keyboard.type(params[0])
+                                    await self.page.keyboard.press("Enter")
+                                elif action == "paste":
+                                    await self.page.keyboard.insert_text(params[0])
+                                    await self.page.keyboard.press("Enter")
                         
                         elif action == "scroll":
                             direction = params[0]
                             self.log(f"Scrolling {direction}...")
-                            await self.page.focus("body")
-                            await self.page.keyboard.press("PageDown" if direction == "down" else "PageUp")
+                            with metrics.span("actions", self.step_spans):
+                                await self.page.focus("body")
+                                await self.page.keyboard.press("PageDown" if direction == "down" else "PageUp")
                         elif action == "ask_user":
                             self.log(f"ASKING USER: {params[0]}", "warning")
                             # In the new UI mode, we should ideally wait for a message back.
                             # For now, we'll just log it and pause the loop in a non-blocking way if possible.
                             # But standard async agentic flow often skips standard input.
-                            break 
+                            left_early = True
+                            break
                         elif action == "wait":
                             self.log("Waiting for page to load...")
-                            await asyncio.sleep(2)
+                        elif action == "split":
+                            if not self.fan_out or not params:
+                                self.log("Parallel tabs are not available here, skipping split.", "warning")
+                                continue
+                            self.log(f"Splitting into {len(params)} parallel tabs...")
+                            with metrics.span("branches", self.step_spans):
+                                branch_results = await self._fan_out([str(p) for p in params], task)
+                            self.log(f"Parallel tabs done: {branch_results}")
+                            continue # This tab wasn't touched, nothing to settle
                         elif action == "finish":
                             self.log("Task finished successfully!", "success")
-                            self._add_to_report(step, thought, ai_view_path, action_results)
+                            outcome = "finished"
+                            if params:
+                                self.result = str(params[0])
+                                self.log(f"Answer: {self.result}", "success")
+                            if decision is not None:
+                                thought = decision.get("thought", thought)
+                                t_model = decision.get("t_first", t_model)
+                            self._record_step(step, thought, actions, ai_view, action_results,
+                                              t_start, t_captured, t_model, cached, settle_times, frame_settings, prefetched,
+                                              checkpoint, replayed)
                             return
                         
-                        await asyncio.sleep(1.5)
+                        # Continue as soon as the page is stable rather than after a fixed delay
+                        with metrics.span("settle", self.step_spans):
+                            settled = await self.settler.wait(self.page, action)
+                        settle_times.append(round(settled, 3))
+
+                    if decision is not None:
+                        res_json = decision.get("response")
+                        if res_json is None and (self.paused or left_early) and not self.stopped:
+                            # Left mid-stream: keep what was acted on, as the blocking path does
+                            res_json = {"thought": decision.get("thought", "None"), "actions": list(actions)}
+                        elif res_json is None:
+                            if self.stopped:
+                                self.log("Agent stopped by user.", "warning")
+                                self.stopped = False
+                            break
+                        else:
+                            self.step_cache.put(task, url, thumb, self.history, res_json)
+                        t_model = decision.get("t_first") or time.perf_counter()
+                        thought = decision.get("thought", "None")
+                        self.history.append(compact_step(action_list(res_json)))
+                        self.history = self.history[-10:] # Keep only last 10 steps
+                    if branch_results:
+                        self.history[-1]["result"] = branch_results
                     
-                    # Add step to HTML report
-                    self._add_to_report(step, thought, ai_view_path, action_results)
-                except json.JSONDecodeError as je:
+                    # Start capturing the next frame now; journaling and session
+                    # persistence run alongside it instead of ahead of it
+                    if not (self.paused or self.stopped or self.page.is_closed()):
+                        prefetch_spans = {}
+                        prefetch = asyncio.create_task(self._capture_frame(prefetch_spans))
+                    self._record_step(step, thought, actions, ai_view, action_results,
+                                      t_start, t_captured, t_model, cached, settle_times, frame_settings, prefetched,
+                                      checkpoint, replayed)
+                except ReplyError as je:
+                    metrics.inc("step_errors")
                     self.log(f"AI response format error: {je}", "error")
+                    await self._capture_error(step, frame, str(je))
                     break
                 except Exception as e:
+                    metrics.inc("step_errors")
+                    await self._capture_error(step, frame, str(e))
                     if "Target page, context or browser has been closed" in str(e):
                         self.log("Browser window closed unexpectedly.", "error")
                     else:
@@ -316,8 +948,30 @@ class WebAgent:
                         import traceback
                         traceback.print_exc()
                     break
+                finally:
+                    # Abandon a stream the action loop left early (finish, stop, error)
+                    if action_source is not None:
+                        await action_source.aclose()
         except Exception as e:
             self.log(f"Critical loop error: {e}", "error")
+        finally:
+            if prefetch:
+                prefetch.cancel()
+            await asyncio.gather(*self._background, return_exceptions=True)
+            await self.writer.flush()
+            if outcome == "finished" and self.trajectories:
+                try:
+                    await asyncio.to_thread(self.trajectories.save, task, start_url, self._trajectory)
+                except Exception as e:
+                    print(f"[ERROR] Could not record trajectory: {e}")
+            self.outcome = outcome
+            await self.journal.append("run_end", outcome=outcome, result=self.result,
+                                      cache={**self.cache_stats, "saved_model_calls": self.cache_stats["hits"]},
+                                      settle=self.settler.summary(),
+                                      parse=self.parse_stats,
+                                      timing=self._timing_summary())
+            with metrics.span("report"):
+                await asyncio.to_thread(self.journal.write_report)
         # Removed context.close() from finally to keep browser open
 
 if __name__ == "__main__":
@@ -0,0 +1,222 @@
+import io
+import os
+import re
+import time
+import asyncio
+import hashlib
+import threading
+import functools
+
+CAPTURE_MODES = ("full", "sampled", "errors", "off")
+
+class CapturePolicy:
+    """
+    Decides which steps save debug images.
+
+    full: every step. sampled: every `every`-th step. errors: only the frame
+    of a step that failed. off: nothing, not even a run directory.
+    """
+    def __init__(self, mode="full", every=5):
+        if mode not in CAPTURE_MODES:
+            raise ValueError(f"Unknown debug capture mode: {mode}")
+        self.mode = mode
+        self.every = max(1, every)
+
+    @classmethod
+    def parse(cls, spec):
+        """Parses 'full', 'sampled:N', 'errors' or 'off'."""
+        mode, _, every = (spec or "full").partition(":")
+        return cls(mode, int(every) if every else 5)
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def capture_step(self, step):
+        if self.mode == "full":
+            return True
+        if self.mode == "sampled":
+            return step % self.every == 0
+        return False
+
+    def capture_error(self):
+        return self.mode in ("full", "sampled", "errors")
+
+def _write_file(path, data):
+    if callable(data):
+        data = data()
+    with open(path, "wb") as f:
+        f.write(data)
+
+# Store keys: content hash plus extension; "_thumb" marks the report thumbnail
+ARTIFACT_KEY = re.compile(r"[0-9a-f]{32}(_thumb)?\.(jpg|webp)")
+
+def thumb_key(key):
+    digest, ext = key.split(".")
+    return f"{digest}_thumb.{ext}"
+
+class ArtifactStore:
+    """
+    Content-addressed debug images shared by every run.
+
+    put() stores an image under the hash of its bytes, so a frame that repeats
+    (a wait, a missed click, a paused page) is written once no matter how many
+    steps or runs show it. Files live in two-character subdirectories to keep
+    directories small. Each image gets a thumbnail for the report and can be
+    re-encoded as WebP. Reusing an image marks it as recently used; once the
+    store grows past `max_bytes`, or files pass `max_age_days`, the least
+    recently used ones are removed. Writes are atomic, so processes sharing
+    the directory never see a partial file.
+    """
+    def __init__(self, root, max_bytes=512 * 2**20, max_age_days=14, webp=False, thumb_width=320):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.webp = webp
+        self.thumb_width = thumb_width
+        self.stats = {"stored": 0, "deduplicated": 0, "evicted": 0}
+        self._size = None # Total bytes on disk, counted on first use
+        self._next_age_check = 0.0
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _encode(self, image, width=None):
+        from PIL import Image
+        if width and image.width > width:
+            image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        buf = io.BytesIO()
+        if self.webp:
+            image.save(buf, format="WEBP", quality=75, method=4)
+        else:
+            image.convert("RGB").save(buf, format="JPEG", quality=70 if width else 85)
+        return buf.getvalue()
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return len(data)
+
+    def put(self, data):
+        """Stores image bytes (or a callable returning them) and returns the key. Blocking; run it off the event loop."""
+        from PIL import Image # Deferred: journal.py imports this module for the server
+        if callable(data):
+            data = data()
+        image = None
+        if self.webp:
+            image = Image.open(io.BytesIO(data))
+            data = self._encode(image)
+        key = f"{hashlib.sha256(data).hexdigest()[:32]}.{'webp' if self.webp else 'jpg'}"
+        path = self.path(key)
+        if os.path.exists(path):
+            try:
+                os.utime(path) # Recently used, evicted last
+                os.utime(self.path(thumb_key(key)))
+            except OSError:
+                pass
+            self.stats["deduplicated"] += 1
+            return key
+        if image is None:
+            image = Image.open(io.BytesIO(data))
+        written = self._write(self.path(thumb_key(key)), self._encode(image, self.thumb_width))
+        written += self._write(path, data)
+        self.stats["stored"] += 1
+        with self._lock:
+            if self._size is not None:
+                self._size += written
+            if self._size is None or self._size > self.max_bytes or time.time() >= self._next_age_check:
+                self._evict(keep=(path, self.path(thumb_key(key))))
+        return key
+
+    def _evict(self, keep=()):
+        entries = []
+        for sub in os.scandir(self.root):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        size = sum(e[1] for e in entries)
+        cutoff = time.time() - self.max_age
+        # Trim to 90% of the limit so eviction doesn't run again on the next put
+        target = self.max_bytes * 0.9 if size > self.max_bytes else self.max_bytes
+        for mtime, bytes_, path in entries:
+            if mtime >= cutoff and size <= target:
+                break
+            if path in keep:
+                continue
+            try:
+                os.remove(path)
+                size -= bytes_
+                self.stats["evicted"] += 1
+            except OSError:
+                pass
+        self._size = size
+        self._next_age_check = time.time() + 3600
+
+_stores = {}
+
+def shared_store(root):
+    """The artifact store for `root`, shared by every agent in the process and configured from the environment."""
+    if root not in _stores:
+        _stores[root] = ArtifactStore(
+            root,
+            max_bytes=int(os.getenv("AGENT_ARTIFACTS_MAX_MB", "512")) * 2**20,
+            max_age_days=float(os.getenv("AGENT_ARTIFACTS_MAX_DAYS", "14")),
+            webp=os.getenv("AGENT_ARTIFACTS_WEBP", "0") == "1",
+        )
+    return _stores[root]
+
+class ArtifactWriter:
+    """
+    Writes files and store images from a bounded background queue.
+
+    write() and store() only enqueue, so disk I/O (and any lazy encoding)
+    stays off the step path. When `max_pending` writes are waiting, they
+    block until the writer catches up instead of buffering without limit.
+    """
+    def __init__(self, max_pending=32, store=None):
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.artifact_store = store
+        self._task = None
+
+    async def _enqueue(self, job, name, future=None):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        await self.queue.put((job, name, future))
+
+    async def write(self, path, data):
+        """Queues `data` (bytes, or a callable returning bytes) for `path`."""
+        await self._enqueue(functools.partial(_write_file, path, data), os.path.basename(path))
+
+    async def store(self, data):
+        """Queues an image for the artifact store. Returns a future for its key (None if storing failed)."""
+        future = asyncio.get_running_loop().create_future()
+        await self._enqueue(functools.partial(self.artifact_store.put, data), "artifact", future)
+        return future
+
+    async def flush(self):
+        """Waits until every queued write has landed on disk."""
+        if self._task:
+            await self.queue.join()
+
+    async def _run(self):
+        while True:
+            job, name, future = await self.queue.get()
+            result = None
+            try:
+                result = await asyncio.to_thread(job)
+            except Exception as e:
+                print(f"[ERROR] Could not write {name}: {e}")
+            finally:
+                if future and not future.done():
+                    future.set_result(result)
+                self.queue.task_done()
@@ -0,0 +1,448 @@
+"""
+Micro-benchmarks for the agent's hot paths.
+
+Usage:
+    python bench.py image [--steps 50] [--clicks 2]
+    python bench.py frame-sizes
+    python bench.py loop-lag [--latency 0.5]
+    python bench.py rate-limit [--agents 4] [--requests 5] [--throttles 3] [--rpm 60]
+    python bench.py dom-index (needs `playwright install chromium`)
+    python bench.py startup [--timeout 60] [--headed] (first-ready needs Edge)
+    python bench.py e2e [--tasks 9] [--latency 0.3] [--throttle-rate 0.1] [--replay] [--out report.json]
+        (needs `playwright install chromium`)
+"""
+import argparse
+import asyncio
+import contextlib
+import functools
+import http.server
+import io
+import os
+import json
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from PIL import Image, ImageDraw
+
+def synthetic_screenshot(width=1280, height=720, seed=0):
+    """Renders a page-like PNG so benchmarks don't need a browser."""
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    for _ in range(60):
+        x, y = rng.randrange(width), rng.randrange(height)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle([x, y, x + rng.randrange(20, 300), y + rng.randrange(10, 80)], fill=color)
+    for row in range(0, height, 18):
+        draw.text((rng.randrange(40), row), "Lorem ipsum dolor sit amet " * 4, fill="black")
+    output = io.BytesIO()
+    img.save(output, format="PNG")
+    return output.getvalue()
+
+def _jpeg_round_trip(image_bytes, draw=None):
+    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    if draw:
+        img = draw(img)
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=80)
+    return output.getvalue()
+
+def _legacy_step(png, clicks):
+    """The pre-Frame pipeline: every view decodes and re-encodes JPEG, and the grid is redrawn each time."""
+    from utils import grid_overlay
+
+    def resize(img):
+        w, h = img.size
+        return img.resize((1024, h * 1024 // w), Image.LANCZOS) if w > 1024 else img
+
+    def add_grid(img):
+        img = img.convert("RGBA")
+        img.alpha_composite(grid_overlay.__wrapped__(img.size))
+        return img.convert("RGB")
+
+    def mark(x_pct, y_pct):
+        def draw(img):
+            x, y = (x_pct * img.size[0]) // 1000, (y_pct * img.size[1]) // 1000
+            ImageDraw.Draw(img).ellipse([(x - 10, y - 10), (x + 10, y + 10)], fill="lime", outline="black")
+            return img
+        return draw
+
+    resized = _jpeg_round_trip(png, resize)
+    grid = _jpeg_round_trip(resized, add_grid)
+    marks = [_jpeg_round_trip(resized, mark(100 * (i + 1), 100 * (i + 1))) for i in range(clicks)]
+    return grid, marks
+
+def _frame_step(png, clicks):
+    from utils import Frame
+    frame = Frame(png)
+    grid = frame.grid_jpeg
+    marks = [frame.mark_click(100 * (i + 1), 100 * (i + 1)) for i in range(clicks)]
+    return grid, marks
+
+def _time_per_step(fn, png, steps, clicks):
+    fn(png, clicks) # warm-up (font load, overlay cache)
+    start = time.process_time()
+    for _ in range(steps):
+        fn(png, clicks)
+    return (time.process_time() - start) / steps * 1000
+
+def bench_image(args):
+    png = synthetic_screenshot()
+    before = _time_per_step(_legacy_step, png, args.steps, args.clicks)
+    after = _time_per_step(_frame_step, png, args.steps, args.clicks)
+    print(f"Per-step image CPU time ({args.steps} steps, {args.clicks} clicks/step)")
+    print(f"  per-view JPEG round trips:        {before:8.2f} ms")
+    print(f"  Frame:                            {after:8.2f} ms")
+    print(f"  speedup:                          {before / after:8.2f}x")
+
+def bench_frame_sizes(args):
+    from utils import Frame
+    from model_client import IMAGE_TOKENS
+    from frame_policy import LEVELS, FIXED
+
+    png = synthetic_screenshot()
+    print("Grid frame upload size per frame policy setting")
+    for label, (width, quality) in [("fixed", FIXED)] + [(f"level {i}", level) for i, level in enumerate(LEVELS)]:
+        size = len(Frame(png, width, quality).grid_jpeg)
+        print(f"  {label:8s} {width:5d}px q{quality:<3d} {size / 1024:8.1f} KB")
+    zoom = Frame(png).crop((400, 400, 600, 600))
+    print(f"  zoom close-up {zoom.size[0]}x{zoom.size[1]}: {len(zoom.grid_jpeg) / 1024:8.1f} KB (+~{IMAGE_TOKENS // 2} tokens per zoom)")
+
+class _BlockingModel:
+    """Stands in for genai.GenerativeModel: a synchronous round-trip."""
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate_content(self, prompt):
+        time.sleep(self.latency)
+        return prompt
+
+async def _max_loop_lag(call, interval=0.01):
+    """Runs call() while a ticker measures the worst event-loop delay."""
+    lag = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal lag
+        loop = asyncio.get_running_loop()
+        while not done:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(lag, loop.time() - start - interval)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(interval) # let the ticker start
+    await call()
+    done = True
+    await tick
+    return lag * 1000
+
+def bench_loop_lag(args):
+    from model_client import ModelClient
+    model = _BlockingModel(args.latency)
+    client = ModelClient(model)
+
+    async def before():
+        model.generate_content("prompt")
+
+    async def after():
+        await client.generate_content("prompt")
+
+    print(f"Max event-loop lag during one model call ({args.latency * 1000:.0f} ms round-trip)")
+    print(f"  blocking generate_content: {asyncio.run(_max_loop_lag(before)):8.2f} ms")
+    print(f"  ModelClient:               {asyncio.run(_max_loop_lag(after)):8.2f} ms")
+
+def bench_rate_limit(args):
+    from fake_model import FakeModel
+    from model_client import ModelClient
+    from rate_limit import RateLimiter, RateLimitExceeded
+
+    async def scenario():
+        limiter = RateLimiter(rpm=args.rpm, max_wait=args.max_wait)
+        model = FakeModel(script=["429"] * args.throttles, latency=args.latency)
+        results = []
+
+        async def agent(client):
+            for _ in range(args.requests):
+                start = time.perf_counter()
+                try:
+                    await client.generate_content(["prompt"])
+                    results.append(("ok", time.perf_counter() - start))
+                except RateLimitExceeded:
+                    results.append(("rejected", time.perf_counter() - start))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(agent(ModelClient(model, limiter)) for _ in range(args.agents)))
+        return limiter, model, results, time.perf_counter() - start
+
+    limiter, model, results, wall = asyncio.run(scenario())
+    ok = [t for status, t in results if status == "ok"]
+    rejected = [t for status, t in results if status == "rejected"]
+    print(f"{args.agents} agents x {args.requests} requests sharing one limiter ({args.rpm} rpm, {args.throttles} scripted 429s)")
+    print(f"  wall time:          {wall:8.2f} s")
+    print(f"  model calls:        {model.calls:8d}")
+    print(f"  completed:          {len(ok):8d}  (max {max(ok, default=0):.2f} s)")
+    print(f"  failed fast:        {len(rejected):8d}  (max {max(rejected, default=0):.2f} s)")
+    print(f"  limiter stats:      {limiter.stats}, concurrency limit {limiter.limit:.2f}")
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def bench_dom_index(args):
+    from playwright.async_api import async_playwright
+    from dom_index import ElementIndex
+    from utils import Frame
+
+    async def scenario():
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=True)
+            page = await browser.new_page(viewport={"width": 1280, "height": 720})
+            await page.goto("file://" + os.path.join(FIXTURES, "elements.html"))
+            index = ElementIndex()
+
+            start = time.perf_counter()
+            first = await index.refresh(page)
+            full_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            unchanged = await index.refresh(page)
+            idle_ms = (time.perf_counter() - start) * 1000
+
+            await page.click("text=Search")
+            start = time.perf_counter()
+            delta = await index.refresh(page)
+            delta_ms = (time.perf_counter() - start) * 1000
+
+            description = index.describe()
+            screenshot = Frame(await page.screenshot()).grid_jpeg
+            await browser.close()
+            return first, full_ms, unchanged, idle_ms, delta, delta_ms, description, screenshot
+
+    first, full_ms, unchanged, idle_ms, delta, delta_ms, description, screenshot = asyncio.run(scenario())
+    print("Element index on fixtures/elements.html")
+    print(f"  first refresh:     {first:3d} entries  {full_ms:7.2f} ms")
+    print(f"  unchanged refresh: {unchanged:3d} entries  {idle_ms:7.2f} ms")
+    print(f"  after a mutation:  {delta:3d} entries  {delta_ms:7.2f} ms")
+    print(f"  ELEMENTS text: {len(description.encode())} bytes vs gridded screenshot {len(screenshot)} bytes")
+    print(description)
+
+def percentile(values, q):
+    """Nearest-rank percentile; None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def serve_fixtures(directory):
+    """Serves `directory` over HTTP on a free local port. Returns (server, base_url)."""
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+def _summarize_run(spec, agent, model, success, wall):
+    events = agent.journal.events()
+    steps = [e for e in events if e["type"] == "step"]
+    end = next((e for e in events if e["type"] == "run_end"), {})
+    stages = {}
+    for event in steps:
+        for stage, seconds in event["timings"].items():
+            if stage != "total":
+                stages[stage] = stages.get(stage, 0.0) + seconds
+        stages["settle"] = stages.get("settle", 0.0) + sum(event.get("settle", []))
+    return {
+        "name": spec["name"],
+        "success": bool(success),
+        "outcome": end.get("outcome"),
+        "steps": len(steps),
+        "wall_seconds": wall,
+        "step_seconds": [e["timings"]["total"] for e in steps],
+        "stage_seconds": stages,
+        "model_calls": model.calls,
+        "bytes_sent": sum(e["usage"]["bytes_sent"] for e in steps),
+        "prompt_tokens": sum(e["usage"]["prompt_tokens"] for e in steps),
+        "cached_tokens": sum(e["usage"].get("cached_tokens", 0) for e in steps),
+        "step_prompt_tokens": [e["usage"]["prompt_tokens"] for e in steps],
+    }
+
+def bench_e2e(args):
+    from playwright.async_api import async_playwright
+    from agent import WebAgent
+    from fake_model import FakeModel
+    from model_client import ModelClient, PrefixCache
+    from rate_limit import RateLimiter
+
+    task_dir = os.path.join(FIXTURES, "tasks")
+    with open(os.path.join(task_dir, "tasks.json"), encoding="utf-8") as f:
+        specs = json.load(f)
+    if args.only:
+        specs = [spec for spec in specs if spec["name"] in args.only]
+    server, base_url = serve_fixtures(task_dir)
+    # Agents keep session files and run journals under the working directory
+    os.chdir(tempfile.mkdtemp(prefix="autobrowser-bench-"))
+
+    async def scenario():
+        limiter = RateLimiter(max_wait=args.max_wait)
+        runs = []
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=True)
+            for n in range(args.tasks):
+                spec = specs[n % len(specs)]
+                model = FakeModel(spec["script"], latency=args.latency, throttle_rate=args.throttle_rate,
+                                  seed=n, retry_after=args.retry_after, chunk_latency=args.chunk_latency)
+                prefix_cache = None if args.no_prefix_cache else PrefixCache(model.bind_prefix)
+                agent = WebAgent(model=ModelClient(model, limiter, prefix_cache=prefix_cache), browser=browser, session_id=f"bench_{n}",
+                                 debug_capture="errors", perception=args.perception, frame_source=args.frame_source,
+                                 replay=args.replay, streaming=not args.no_streaming)
+                await agent.start_browser(base_url + spec["page"])
+                start = time.perf_counter()
+                await agent.run(spec["task"])
+                wall = time.perf_counter() - start
+                success = await agent.page.evaluate(spec["success"])
+                await agent.stop_browser()
+                runs.append(_summarize_run(spec, agent, model, success, wall))
+            await browser.close()
+        return runs
+
+    try:
+        # Agent logs go to stderr so stdout stays machine-readable
+        with contextlib.redirect_stdout(sys.stderr):
+            runs = asyncio.run(scenario())
+    finally:
+        server.shutdown()
+
+    step_seconds = [t for run in runs for t in run["step_seconds"]]
+    stage_seconds = {}
+    for run in runs:
+        for stage, seconds in run["stage_seconds"].items():
+            stage_seconds[stage] = stage_seconds.get(stage, 0.0) + seconds
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "func"},
+        "summary": {
+            "tasks": len(runs),
+            "succeeded": sum(run["success"] for run in runs),
+            "steps_per_task": sum(run["steps"] for run in runs) / len(runs) if runs else 0,
+            "wall_seconds": {"p50": percentile([r["wall_seconds"] for r in runs], 50),
+                             "p95": percentile([r["wall_seconds"] for r in runs], 95)},
+            "step_latency_seconds": {"p50": percentile(step_seconds, 50), "p95": percentile(step_seconds, 95)},
+            "stage_seconds": stage_seconds,
+            "model_calls": sum(run["model_calls"] for run in runs),
+            "bytes_sent": sum(run["bytes_sent"] for run in runs),
+            "prompt_tokens": sum(run["prompt_tokens"] for run in runs),
+            "cached_tokens": sum(run["cached_tokens"] for run in runs),
+            "step_prompt_tokens": {"p50": percentile([t for r in runs for t in r["step_prompt_tokens"]], 50),
+                                   "p95": percentile([t for r in runs for t in r["step_prompt_tokens"]], 95)},
+        },
+        "runs": runs,
+    }
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+def _import_seconds(module):
+    """Import time of `module` in a fresh interpreter."""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+def bench_startup(args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, AGENT_HEADLESS="0" if args.headed else "1")
+
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+                              cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    http_up = first_ready = None
+    status = {}
+    try:
+        while time.perf_counter() - start < args.timeout and server.poll() is None:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    status = json.load(response)
+            except OSError:
+                time.sleep(0.02)
+                continue
+            http_up = http_up or time.perf_counter() - start
+            if status.get("ready"):
+                first_ready = time.perf_counter() - start
+                break
+            time.sleep(0.05)
+    finally:
+        server.terminate()
+        server.wait()
+
+    fmt = lambda t: f"{t:8.2f} s" if t is not None else "     n/a"
+    print(f"Server cold start ({'headed' if args.headed else 'headless'}, timeout {args.timeout:.0f} s)")
+    print(f"  import server:        {fmt(_import_seconds('server'))}")
+    print(f"  import Gemini SDK:    {fmt(_import_seconds('google.generativeai'))}  (now preloaded during browser launch)")
+    print(f"  /health answering:    {fmt(http_up)}")
+    print(f"  first ready agent:    {fmt(first_ready)}  (pool reported {fmt(status.get('startup_seconds')).strip()})")
+
+def main():
+    parser = argparse.ArgumentParser(description="AutoBrowser benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    image = sub.add_parser("image", help="screenshot processing CPU time per step")
+    image.add_argument("--steps", type=int, default=50)
+    image.add_argument("--clicks", type=int, default=2)
+    image.set_defaults(func=bench_image)
+
+    sizes = sub.add_parser("frame-sizes", help="bytes uploaded per frame policy level")
+    sizes.set_defaults(func=bench_frame_sizes)
+
+    lag = sub.add_parser("loop-lag", help="event-loop lag during a model call")
+    lag.add_argument("--latency", type=float, default=0.5)
+    lag.set_defaults(func=bench_loop_lag)
+
+    rate = sub.add_parser("rate-limit", help="shared limiter against a fake model returning 429s")
+    rate.add_argument("--agents", type=int, default=4)
+    rate.add_argument("--requests", type=int, default=5)
+    rate.add_argument("--throttles", type=int, default=3)
+    rate.add_argument("--rpm", type=int, default=60)
+    rate.add_argument("--latency", type=float, default=0.05)
+    rate.add_argument("--max-wait", type=float, default=30.0)
+    rate.set_defaults(func=bench_rate_limit)
+
+    dom = sub.add_parser("dom-index", help="element index size and refresh cost on a local fixture")
+    dom.set_defaults(func=bench_dom_index)
+
+    startup = sub.add_parser("startup", help="time until the server answers and the first agent has a browser")
+    startup.add_argument("--timeout", type=float, default=60.0)
+    startup.add_argument("--headed", action="store_true")
+    startup.set_defaults(func=bench_startup)
+
+    e2e = sub.add_parser("e2e", help="scripted tasks on local fixtures in headless Chromium, JSON report")
+    e2e.add_argument("--tasks", type=int, default=9)
+    e2e.add_argument("--only", nargs="*", help="fixture task names to run")
+    e2e.add_argument("--latency", type=float, default=0.3, help="fake model round-trip in seconds")
+    e2e.add_argument("--chunk-latency", type=float, default=0.01, help="fake decode time per 16-character chunk")
+    e2e.add_argument("--no-streaming", action="store_true", help="wait for whole replies instead of streaming them")
+    e2e.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of model calls answered with a 429")
+    e2e.add_argument("--retry-after", type=float, default=0.5, help="retry hint on injected 429s")
+    e2e.add_argument("--max-wait", type=float, default=30.0)
+    e2e.add_argument("--perception", default="screenshot", choices=["screenshot", "dom", "hybrid"])
+    e2e.add_argument("--frame-source", default="screencast", choices=["screencast", "screenshot"])
+    e2e.add_argument("--no-prefix-cache", action="store_true", help="send the system prompt and task with every step")
+    e2e.add_argument("--replay", action="store_true", help="record successful runs and replay them on repeats")
+    e2e.add_argument("--out", help="also write the JSON report to this file")
+    e2e.set_defaults(func=bench_e2e)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import json
+import hashlib
+
+# Indexes interactive elements in the page. The first call per document tags
+# every match with a stable data-agent-id and installs a MutationObserver;
+# later calls only rescan subtrees the observer saw change, and only return
+# entries whose role, name or box changed since the previous call.
+INDEX_SCRIPT = """
+() => {
+    const SELECTOR = 'a[href], button, input:not([type=hidden]), select, textarea, summary, [onclick], ' +
+        '[contenteditable=""], [contenteditable=true], [role=button], [role=link], [role=checkbox], [role=radio], ' +
+        '[role=tab], [role=menuitem], [role=option], [role=switch], [role=textbox], [role=combobox], [role=searchbox]';
+    const TAG_ROLES = {A: 'link', BUTTON: 'button', SELECT: 'select', TEXTAREA: 'textbox', SUMMARY: 'button'};
+
+    let state = window.__agentIndex;
+    const reset = !state;
+    if (reset) {
+        state = window.__agentIndex = {next: 1, elements: new Map(), sent: new Map(), dirty: [document.documentElement]};
+        new MutationObserver(records => {
+            for (const record of records) {
+                if (record.type === 'childList') {
+                    record.addedNodes.forEach(node => node.nodeType === 1 && state.dirty.push(node));
+                } else if (record.target.nodeType === 1) {
+                    state.dirty.push(record.target);
+                }
+            }
+        }).observe(document, {subtree: true, childList: true, attributes: true,
+                              attributeFilter: ['role', 'href', 'onclick', 'contenteditable', 'disabled', 'aria-label']});
+    }
+
+    for (const root of state.dirty) {
+        if (!root.isConnected) continue;
+        const found = root.matches(SELECTOR) ? [root] : [];
+        found.push(...root.querySelectorAll(SELECTOR));
+        for (const el of found) {
+            if (!el.dataset.agentId) el.dataset.agentId = String(state.next++);
+            state.elements.set(el.dataset.agentId, el);
+        }
+    }
+    state.dirty = [];
+
+    const changed = [], removed = [];
+    const vw = window.innerWidth, vh = window.innerHeight;
+    for (const [id, el] of state.elements) {
+        const r = el.isConnected ? el.getBoundingClientRect() : null;
+        const visible = r && r.width > 0 && r.height > 0 && r.bottom > 0 && r.right > 0 && r.top < vh && r.left < vw;
+        if (!visible) {
+            if (!el.isConnected) state.elements.delete(id);
+            if (state.sent.delete(id)) removed.push(id);
+            continue;
+        }
+        let role = el.getAttribute('role') || TAG_ROLES[el.tagName] || 'clickable';
+        if (el.tagName === 'INPUT') {
+            role = ['checkbox', 'radio'].includes(el.type) ? el.type
+                : ['submit', 'button', 'reset', 'image'].includes(el.type) ? 'button' : 'textbox';
+        }
+        const label = el.labels && el.labels[0] ? el.labels[0].innerText : '';
+        const name = (el.getAttribute('aria-label') || label || el.innerText || el.placeholder ||
+                      el.value || el.title || el.alt || '').trim().replace(/\\s+/g, ' ').slice(0, 80);
+        const entry = {id, role, name, box: [r.left, r.top, r.width, r.height].map(Math.round), disabled: !!el.disabled};
+        const key = JSON.stringify(entry);
+        if (state.sent.get(id) !== key) {
+            state.sent.set(id, key);
+            changed.push(entry);
+        }
+    }
+    return {reset, changed, removed, viewport: [vw, vh]};
+}
+"""
+
+class ElementIndex:
+    """
+    Python-side cache of the page's interactive elements.
+
+    refresh() costs one page.evaluate and transfers only what changed, so a
+    stable page is nearly free to re-read. Elements are described to the
+    model as compact lines it can answer with click(id).
+    """
+    def __init__(self, max_elements=150):
+        self.max_elements = max_elements
+        self.elements = {} # id -> {"id", "role", "name", "box", "disabled"}
+        self.viewport = (1280, 720)
+        self._page = None
+
+    async def refresh(self, page):
+        data = await page.evaluate(INDEX_SCRIPT)
+        if data["reset"] or page is not self._page:
+            self.elements = {}
+            self._page = page
+        self.viewport = tuple(data["viewport"])
+        for element_id in data["removed"]:
+            self.elements.pop(element_id, None)
+        for entry in data["changed"]:
+            self.elements[entry["id"]] = entry
+        return len(data["changed"]) + len(data["removed"])
+
+    def center(self, element_id):
+        """Center of the element's visible part in 0-1000 units, or None if unknown."""
+        entry = self.elements.get(str(element_id))
+        if not entry:
+            return None
+        vw, vh = self.viewport
+        x, y, w, h = entry["box"]
+        cx = (max(x, 0) + min(x + w, vw)) / 2
+        cy = (max(y, 0) + min(y + h, vh)) / 2
+        return round(cx * 1000 / vw), round(cy * 1000 / vh)
+
+    def describe(self):
+        """One line per element in reading order: id, role, name and center."""
+        ordered = sorted(self.elements.values(), key=lambda e: (e["box"][1], e["box"][0]))
+        lines = []
+        for entry in ordered[:self.max_elements]:
+            x, y = self.center(entry["id"])
+            disabled = " disabled" if entry["disabled"] else ""
+            lines.append(f'{entry["id"]} {entry["role"]}{disabled} {json.dumps(entry["name"])} ({x},{y})')
+        return "\n".join(lines)
+
+    def signature(self):
+        """Short hash of which elements are on screen (roles and names, not positions)."""
+        names = sorted(f'{e["role"]}:{e["name"]}' for e in self.elements.values())
+        return hashlib.sha1("\n".join(names).encode()).hexdigest()[:16]
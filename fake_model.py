@@ -0,0 +1,101 @@
+import json
+import random
+import asyncio
+from types import SimpleNamespace
+from model_client import estimate_tokens, MIN_CACHE_TOKENS
+
+class FakeResourceExhausted(Exception):
+    """Looks like the 429 google.api_core raises, including the retry hint."""
+    def __init__(self, retry_after=1.0):
+        super().__init__(f"429 ResourceExhausted: Quota exceeded. Please retry in {retry_after}s.")
+        self.retry_after = retry_after
+
+def fake_response(text, prompt_tokens=0, cached_tokens=0):
+    """Builds an object shaped like a genai GenerateContentResponse."""
+    parts = [SimpleNamespace(text=text)] if text else []
+    return SimpleNamespace(
+        text=text,
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=parts))],
+        usage_metadata=SimpleNamespace(prompt_token_count=prompt_tokens, cached_content_token_count=cached_tokens,
+                                       total_token_count=prompt_tokens + len(text) // 4),
+    )
+
+class FakeModel:
+    """
+    Offline stand-in for genai.GenerativeModel.
+
+    Replays `script` in order. Each entry is a response dict (sent as JSON),
+    a raw string, an Exception instance to raise, or the string "429" as a
+    shortcut for FakeResourceExhausted. Once the script runs out, `default`
+    is returned. Every call waits `latency` seconds. With `throttle_rate`, that
+    fraction of calls also fails with a 429 before consuming the script,
+    drawn from a generator seeded with `seed` so runs are repeatable.
+
+    With stream=True the reply is delivered in `chunk_size`-character chunks,
+    `chunk_latency` seconds apart, the way a model decodes tokens; without it
+    the whole reply arrives after the same total decode time.
+
+    bind_prefix() hands out views that hold a prompt prefix the way the
+    Gemini client does: its tokens always count as prompt, and as cached only
+    when the prefix reaches MIN_CACHE_TOKENS, the size below which no
+    explicit context cache is created.
+    """
+    def __init__(self, script=(), latency=0.0, default=None, throttle_rate=0.0, seed=0, retry_after=1.0,
+                 chunk_size=16, chunk_latency=0.0):
+        self.script = list(script)
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chunk_latency = chunk_latency
+        self.default = default if default is not None else {"thought": "Done.", "actions": [{"action": "finish", "params": []}]}
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.prompts = []
+        self.configs = []
+        self.prefixes = []
+
+    def _next(self):
+        return self.script.pop(0) if self.script else self.default
+
+    def bind_prefix(self, prefix, ttl=None):
+        """For model_client.PrefixCache; the view shares this model's script and counters."""
+        self.prefixes.append(prefix)
+        return PrefixedFakeModel(self, prefix)
+
+    async def generate_content_async(self, prompt, stream=False, generation_config=None, prefix=None):
+        self.calls += 1
+        self.prompts.append(prompt)
+        self.configs.append(generation_config)
+        await asyncio.sleep(self.latency)
+        if self.throttle_rate and self.rng.random() < self.throttle_rate:
+            raise FakeResourceExhausted(self.retry_after)
+        entry = self._next()
+        if entry == "429":
+            raise FakeResourceExhausted(self.retry_after)
+        if isinstance(entry, Exception):
+            raise entry
+        text = entry if isinstance(entry, str) else json.dumps(entry)
+        prefix_tokens = estimate_tokens([prefix]) if prefix else 0
+        cached = prefix_tokens if prefix_tokens >= MIN_CACHE_TOKENS else 0
+        tokens = estimate_tokens(prompt) + prefix_tokens
+        if stream:
+            return self._stream(text, tokens, cached)
+        chunks = -(-len(text) // self.chunk_size)
+        await asyncio.sleep(self.chunk_latency * max(0, chunks - 1))
+        return fake_response(text, tokens, cached)
+
+    async def _stream(self, text, prompt_tokens, cached_tokens):
+        for start in range(0, len(text), self.chunk_size):
+            if start:
+                await asyncio.sleep(self.chunk_latency)
+            yield fake_response(text[start:start + self.chunk_size], prompt_tokens, cached_tokens)
+
+class PrefixedFakeModel:
+    """A FakeModel whose requests continue a cached `prefix`."""
+    def __init__(self, model, prefix):
+        self.model = model
+        self.prefix = prefix
+
+    async def generate_content_async(self, prompt, stream=False, generation_config=None):
+        return await self.model.generate_content_async(prompt, stream, generation_config, prefix=self.prefix)
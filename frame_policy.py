@@ -0,0 +1,40 @@
+# (max_width, JPEG quality) per level, cheapest first
+LEVELS = [(768, 60), (1024, 75), (1280, 85)]
+
+# What the agent sent before adaptive frames existed
+FIXED = (1024, 80)
+
+class FramePolicy:
+    """
+    Picks the resolution and quality of the frame sent to the model each step.
+
+    "adaptive" starts at the cheapest level. When a click/type step leaves
+    the screen unchanged (usually a misclick), it steps up a level. After
+    `relax_after` steps in a row that made progress, it steps back down.
+    "fixed" always sends the original 1024px / quality 80 frame.
+    """
+    def __init__(self, mode="adaptive", relax_after=3):
+        if mode not in ("adaptive", "fixed"):
+            raise ValueError(f"Unknown frame policy: {mode}")
+        self.mode = mode
+        self.relax_after = relax_after
+        self.level = 0
+        self._streak = 0
+
+    def settings(self):
+        """(max_width, quality) for the next frame."""
+        return FIXED if self.mode == "fixed" else LEVELS[self.level]
+
+    def observe(self, progressed):
+        if progressed:
+            self._streak += 1
+            if self._streak >= self.relax_after and self.level > 0:
+                self.level -= 1
+                self._streak = 0
+        else:
+            self._streak = 0
+            self.level = min(self.level + 1, len(LEVELS) - 1)
+
+    def reset(self):
+        self.level = 0
+        self._streak = 0
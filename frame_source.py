@@ -0,0 +1,156 @@
+import base64
+import asyncio
+
+class ScreenshotSource:
+    """Captures a full-resolution PNG with page.screenshot() on every read."""
+    streaming = False
+
+    async def ensure(self, page):
+        self.page = page
+
+    def configure(self, max_width, quality):
+        pass
+
+    def mark_action(self):
+        pass
+
+    async def latest(self):
+        return await self.page.screenshot()
+
+    async def stop(self):
+        pass
+
+class ScreencastSource:
+    """
+    Reads frames from Chromium's Page.startScreencast over a CDP session.
+
+    Chromium pushes JPEGs already scaled to the model width whenever the page
+    repaints; only the newest one is kept, so latest() returns immediately
+    with no capture latency. `seq` increases with every new frame, which lets
+    change detection skip pixel comparisons. Falls back to page.screenshot()
+    if the screencast can't start or hasn't produced a frame yet.
+
+    Chromium only sends frames when it paints, and a background, minimized
+    or occluded window may not paint at all. So the agent calls
+    mark_action() before acting, and a frame counts as current (`fresh`)
+    only if it arrived after that; otherwise latest() takes a screenshot.
+    """
+    def __init__(self, max_width=1024, quality=80, first_frame_timeout=1.0):
+        self.max_width = max_width
+        self.quality = quality
+        self.first_frame_timeout = first_frame_timeout
+        self.page = None
+        self.cdp = None
+        self.frame = None
+        self.seq = 0
+        self._action_seq = 0 # seq when the last action started
+        self._unavailable = False
+        self._arrived = asyncio.Event()
+        self._tasks = set() # Restarts and frame acks in flight
+
+    @property
+    def streaming(self):
+        return self.cdp is not None
+
+    async def ensure(self, page):
+        """Starts (or moves) the screencast to `page`."""
+        if page is self.page and (self.cdp or self._unavailable):
+            return
+        await self.stop()
+        self.page = page
+        self._unavailable = False
+        try:
+            self.cdp = await page.context.new_cdp_session(page)
+            self.cdp.on("Page.screencastFrame", self._on_frame)
+            await self._start()
+        except Exception as e:
+            print(f"[WARNING] Screencast unavailable, using screenshots: {e}")
+            self.cdp = None
+            self._unavailable = True
+
+    async def _start(self):
+        viewport = self.page.viewport_size or {"width": 1280, "height": 720}
+        await self.cdp.send("Page.startScreencast", {
+            "format": "jpeg",
+            "quality": self.quality,
+            "maxWidth": self.max_width,
+            "maxHeight": self.max_width * viewport["height"] // viewport["width"],
+            "everyNthFrame": 1,
+        })
+
+    def configure(self, max_width, quality):
+        """Restarts the stream if the frame policy asks for a different size or quality."""
+        if (max_width, quality) == (self.max_width, self.quality):
+            return
+        self.max_width, self.quality = max_width, quality
+        if self.cdp:
+            self.frame = None
+            self._arrived.clear()
+            self._spawn(self._restart())
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _restart(self):
+        try:
+            await self.cdp.send("Page.stopScreencast")
+            await self._start()
+        except Exception as e:
+            # Stay on screenshots for this page rather than reconnecting every step
+            print(f"[WARNING] Screencast restart failed, using screenshots: {e}")
+            self.cdp = None
+            self._unavailable = True
+
+    def mark_action(self):
+        """Frames received so far predate the action about to run."""
+        self._action_seq = self.seq
+
+    @property
+    def fresh(self):
+        """Whether a frame has arrived since the last action."""
+        return self.frame is not None and self.seq > self._action_seq
+
+    def _on_frame(self, params):
+        self.frame = base64.b64decode(params["data"])
+        self.seq += 1
+        self._arrived.set()
+        # Chromium stops sending until each frame is acknowledged
+        self._spawn(self._ack(params["sessionId"]))
+
+    async def _ack(self, session_id):
+        try:
+            await self.cdp.send("Page.screencastFrameAck", {"sessionId": session_id})
+        except Exception:
+            pass
+
+    async def latest(self):
+        if self.cdp and self.frame is None:
+            try:
+                await asyncio.wait_for(self._arrived.wait(), self.first_frame_timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self.cdp and self.fresh:
+            return self.frame
+        return await self.page.screenshot()
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self.cdp:
+            try:
+                await self.cdp.send("Page.stopScreencast")
+                await self.cdp.detach()
+            except Exception:
+                pass
+        self.cdp = None
+        self.frame = None
+        self._arrived.clear()
+
+def frame_source(mode):
+    if mode == "screencast":
+        return ScreencastSource()
+    if mode == "screenshot":
+        return ScreenshotSource()
+    raise ValueError(f"Unknown frame source: {mode}")
@@ -0,0 +1,33 @@
+import json
+from utils import thumbprint_changes
+
+def compact_step(actions):
+    """A history entry: each action as [name, *params], plus the outcome once the next frame shows it."""
+    return {"actions": [[act.get("action"), *act.get("params", [])] for act in actions], "result": None}
+
+def describe_outcome(url_before, url_after, thumb_before, thumb_after):
+    """Short summary of what a step's actions did to the page, from the URLs and frame thumbprints."""
+    if url_after and url_after != url_before:
+        return f"now on {url_after}"
+    if thumbprint_changes(thumb_before, thumb_after) == 0:
+        return "no visible change"
+    return "page changed"
+
+def _call(entry):
+    name, *params = entry
+    return f"{name}({', '.join(json.dumps(p) for p in params)})"
+
+def encode_history(history, depth=3):
+    """
+    The last `depth` steps as one line each, e.g.
+    `click(450, 210) -> no visible change`. Only actions and outcomes are
+    sent; the model's free-form thoughts cost tokens without changing what
+    it should do next.
+    """
+    lines = []
+    for entry in history[-depth:]:
+        line = "; ".join(_call(a) for a in entry["actions"]) or "nothing"
+        if entry.get("result"):
+            line += f" -> {entry['result']}"
+        lines.append(f"- {line}")
+    return "\n".join(lines) if lines else "none yet"
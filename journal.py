@@ -0,0 +1,122 @@
+import os
+import json
+import html
+import time
+import asyncio
+from artifacts import ARTIFACT_KEY, thumb_key
+
+REPORT_STYLE = """
+    body { font-family: sans-serif; background: #1a1a1a; color: #eee; padding: 20px; }
+    .step { border: 1px solid #444; margin-bottom: 30px; padding: 15px; border-radius: 8px; background: #2a2a2a; }
+    .thought { font-style: italic; color: #aaa; margin-bottom: 15px; }
+    .meta { font-size: 0.85em; color: #888; margin-bottom: 10px; }
+    .views { display: flex; gap: 20px; }
+    .view { flex: 1; }
+    img { width: 100%; border-radius: 4px; border: 1px solid #555; }
+    .view a { display: block; }
+    h3 { margin-top: 0; color: #00d4ff; }
+    .label { font-weight: bold; margin-bottom: 5px; }
+"""
+
+class RunJournal:
+    """
+    Append-only JSONL log of one agent run.
+
+    Each step is a single appended line, so recording costs the same at step
+    1 and step 100. The HTML report is rendered from the journal on demand
+    (or once when the run ends) instead of being rewritten every step.
+    Without a run_dir (debug capture off) nothing is recorded.
+    """
+    def __init__(self, run_dir, run_id):
+        self.run_dir = run_dir
+        self.run_id = run_id
+        self.path = os.path.join(run_dir, "journal.jsonl") if run_dir else None
+        self.report_path = os.path.join(run_dir, "report.html") if run_dir else None
+
+    def _append(self, line):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    async def append(self, type, **fields):
+        """Records one event without blocking the event loop."""
+        if not self.path:
+            return
+        event = {"type": type, "time": time.time(), **fields}
+        await asyncio.to_thread(self._append, json.dumps(event) + "\n")
+
+    def events(self):
+        if not self.path or not os.path.exists(self.path):
+            return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    @staticmethod
+    def _file_url(key):
+        # The report sits in debug/run_<id>/, the store in debug/artifacts/
+        return f"../artifacts/{key[:2]}/{key}"
+
+    def render_html(self, asset_url=None):
+        """
+        Renders the run as HTML. Images show as thumbnails linking to the full
+        frame; asset_url(key) gives their URLs (by default relative to the
+        report file).
+        """
+        asset_url = asset_url or self._file_url
+
+        def image(key):
+            if not ARTIFACT_KEY.fullmatch(key):
+                return f'<img src="{asset_url(key)}">' # File name from before the artifact store
+            return f'<a href="{asset_url(key)}"><img src="{asset_url(thumb_key(key))}" loading="lazy"></a>'
+
+        steps = []
+        for event in self.events():
+            if event["type"] == "error":
+                image_html = image(event["artifact"]) if event.get("artifact") else ""
+                steps.append(f"""
+        <div class="step">
+            <h3>Step {event["step"]} failed</h3>
+            <div class="thought"><b>Error:</b> {html.escape(str(event.get("error")))}</div>
+            <div class="views"><div class="view">{image_html}</div></div>
+        </div>""")
+            if event["type"] != "step":
+                continue
+            artifacts = event.get("artifacts", {})
+            views = ""
+            if artifacts.get("ai_view"):
+                views += f'<div class="view"><div class="label">AI View (Grid Version)</div>{image(artifacts["ai_view"])}</div>'
+            for i, key in enumerate(artifacts.get("clicks", [])):
+                if key:
+                    views += f'<div class="view"><div class="label">Action {i} Verification</div>{image(key)}</div>'
+            timings = ", ".join(f"{k} {v:.2f}s" for k, v in event.get("timings", {}).items())
+            timings += "".join(f", settle {t:.2f}s" for t in event.get("settle", []))
+            usage = event.get("usage")
+            if usage:
+                timings += f" | {usage['bytes_sent'] // 1024} KB sent, {usage['prompt_tokens']} prompt tokens"
+            actions = html.escape(json.dumps(event.get("actions", [])))
+            steps.append(f"""
+        <div class="step">
+            <h3>Step {event["step"]}</h3>
+            <div class="thought"><b>Thought:</b> {html.escape(str(event.get("thought")))}</div>
+            <div class="meta">Actions: {actions}<br>Timings: {timings}</div>
+            <div class="views">{views}</div>
+        </div>""")
+
+        return f"""
+        <html>
+        <head>
+            <title>Web Agent Debug Report</title>
+            <style>{REPORT_STYLE}</style>
+        </head>
+        <body>
+            <h1>Agent Run: {self.run_id}</h1>
+            {"".join(steps)}
+        </body>
+        </html>
+        """
+
+    def write_report(self):
+        if not self.report_path:
+            return None
+        with open(self.report_path, "w", encoding="utf-8") as f:
+            f.write(self.render_html())
+        return self.report_path
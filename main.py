@@ -3,18 +3,34 @@ import subprocess
 import time
 import os
 import sys
+import urllib.request
+
+HEALTH_URL = "http://127.0.0.1:8000/health"
 
 def start_server():
     """Starts the FastAPI server in a separate process."""
     cmd = [sys.executable, "server.py"]
     return subprocess.Popen(cmd)
 
+def wait_for_server(process, timeout=30):
+    """Polls /health until the server answers, instead of sleeping a fixed time."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            with urllib.request.urlopen(HEALTH_URL, timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
 if __name__ == "__main__":
     # Start the backend server
     server_process = start_server()
     
-    # Wait a moment for server to start
-    time.sleep(2)
+    # Open the overlay as soon as the server answers; the browser keeps
+    # warming up in the background and tasks sent early just queue
+    if not wait_for_server(server_process):
+        print("[WARNING] Server did not report healthy, opening the overlay anyway.")
     
     # Load the index.html
     current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -0,0 +1,111 @@
+import os
+import time
+
+# Upper bounds, in seconds, of the stage duration histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+COUNTERS = {
+    "steps": "Agent steps started.",
+    "model_calls": "Model requests that returned a response.",
+    "model_retries": "Model requests retried after a rate limit.",
+    "rate_limited": "Runs stopped because the rate limit persisted.",
+    "empty_responses": "Model responses without content.",
+    "parse_clean": "Model replies that parsed as sent.",
+    "parse_repaired": "Model replies that needed local repair.",
+    "parse_reprompted": "Model replies that had to be asked for again.",
+    "parse_failures": "Model replies that stayed unusable after re-prompting.",
+    "cache_hits": "Steps answered from the step cache.",
+    "cache_misses": "Steps that needed a model call.",
+    "replayed_steps": "Steps taken from a recorded trajectory without the model.",
+    "replay_divergences": "Replays abandoned because the page no longer matched.",
+    "bytes_uploaded": "Prompt bytes sent to the model, images included.",
+    "prompt_tokens": "Prompt tokens reported by the model.",
+    "cached_tokens": "Prompt tokens the model served from a cached prefix.",
+    "branches": "Parallel tabs opened by split().",
+    "step_errors": "Steps that failed with an exception.",
+}
+
+class Span:
+    """Times one stage; adds it to the histogram and, if given, to a per-step dict."""
+    __slots__ = ("metrics", "stage", "into", "start")
+
+    def __init__(self, metrics, stage, into):
+        self.metrics = metrics
+        self.stage = stage
+        self.into = into
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.metrics.observe(self.stage, elapsed)
+        if self.into is not None:
+            self.into[self.stage] = self.into.get(self.stage, 0.0) + elapsed
+        return False
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NO_SPAN = _NoSpan()
+
+class Metrics:
+    """
+    Process-wide stage timings and counters for all agents.
+
+    span(stage) times a block into a Prometheus histogram, inc() bumps a
+    counter, and render() produces the text exposition format for /metrics.
+    When disabled, span() hands back one shared no-op object and inc()
+    returns immediately, so instrumented code pays a method call at most.
+    """
+    def __init__(self, enabled=True, buckets=BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.stages = {} # stage -> [bucket counts..., count, sum]
+
+    def span(self, stage, into=None):
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, stage, into)
+
+    def inc(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage, seconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = [0] * len(self.buckets) + [0, 0.0]
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                histogram[i] += 1
+        histogram[-2] += 1
+        histogram[-1] += seconds
+
+    def render(self):
+        lines = [
+            "# HELP agent_stage_seconds Time spent in each stage of an agent step.",
+            "# TYPE agent_stage_seconds histogram",
+        ]
+        for stage, histogram in sorted(self.stages.items()):
+            for bound, count in zip(self.buckets, histogram):
+                lines.append(f'agent_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'agent_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram[-2]}')
+            lines.append(f'agent_stage_seconds_count{{stage="{stage}"}} {histogram[-2]}')
+            lines.append(f'agent_stage_seconds_sum{{stage="{stage}"}} {histogram[-1]:.6f}')
+        for name, value in self.counters.items():
+            lines.append(f"# HELP agent_{name}_total {COUNTERS.get(name, name)}")
+            lines.append(f"# TYPE agent_{name}_total counter")
+            lines.append(f"agent_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+# Shared by every agent in the process; AGENT_METRICS=0 turns it off
+metrics = Metrics(enabled=os.getenv("AGENT_METRICS", "1") != "0")
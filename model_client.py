@@ -0,0 +1,243 @@
+import time
+import asyncio
+import hashlib
+import importlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from rate_limit import RateLimitExceeded, is_rate_limit_error, retry_after_hint, shared_limiter
+
+# Shared pool for models that only expose a blocking generate_content().
+# Bounded so a burst of requests can't spawn unlimited threads.
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="model")
+
+# Rough per-image cost used for token budgeting before the real count is known
+# (Gemini bills 258 tokens per 768px tile; a 1024px-wide frame is two tiles).
+IMAGE_TOKENS = 516
+
+def estimate_tokens(prompt):
+    tokens = 0
+    for part in prompt:
+        if isinstance(part, dict):
+            tokens += IMAGE_TOKENS
+        else:
+            tokens += len(str(part)) // 4
+    return tokens
+
+def chunk_text(chunk):
+    """Text of a response chunk; chunks without parts (e.g. the final one of a stream) have none."""
+    try:
+        return chunk.text or ""
+    except (ValueError, AttributeError):
+        return ""
+
+# Explicit context caches below this size are refused by the API (or cost
+# more to store than they save); smaller prefixes rely on implicit caching
+MIN_CACHE_TOKENS = 1024
+
+def prompt_bytes(prompt):
+    """Request payload size: image bytes plus UTF-8 text."""
+    return sum(len(part["data"]) if isinstance(part, dict) else len(str(part).encode()) for part in prompt)
+
+class PrefixCache:
+    """
+    Models bound to a fixed prompt prefix, created by `bind(prefix, ttl)` and
+    reused until `ttl` seconds have passed (less `margin`, so a server-side
+    cache is never used as it expires). Concurrent requests for the same
+    prefix wait for a single bind.
+    """
+    def __init__(self, bind, ttl=3600, margin=60):
+        self.bind = bind
+        self.ttl = ttl
+        self.margin = margin
+        self._entries = {} # prefix hash -> (model, expires)
+        self._locks = {}
+
+    async def get(self, prefix):
+        key = hashlib.sha1(prefix.encode()).hexdigest()
+        now = time.monotonic()
+        for stale in [k for k, (_, expires) in self._entries.items() if expires <= now]:
+            del self._entries[stale]
+        if key in self._entries:
+            return self._entries[key][0]
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if key not in self._entries:
+                model = await asyncio.to_thread(self.bind, prefix, self.ttl)
+                self._entries[key] = (model, time.monotonic() + self.ttl - self.margin)
+        self._locks.pop(key, None)
+        return self._entries[key][0]
+
+class ModelClient:
+    """
+    Async wrapper around a Gemini-style model.
+
+    Uses the model's native generate_content_async() when it has one, so
+    cancelling the awaiting task cancels the request itself. Blocking models
+    run on the shared executor; cancelling then abandons the call and returns
+    control immediately, while the worker thread finishes in the background.
+
+    Every request goes through the process-wide RateLimiter. 429s are retried
+    with jittered backoff that honors the server's retry hint; if the wait
+    would be too long, RateLimitExceeded is raised instead.
+
+    `generation_config` is sent with every request unless a call passes its
+    own; with neither, none is sent and the model's defaults apply. With a
+    `prefix_cache`, with_prefix() returns clients whose prompts continue a
+    prefix the model already holds.
+    """
+    def __init__(self, model, limiter=None, max_attempts=5, generation_config=None, prefix_cache=None):
+        self.model = model
+        self.limiter = limiter or shared_limiter()
+        self.max_attempts = max_attempts
+        self.generation_config = generation_config
+        self.prefix_cache = prefix_cache
+
+    async def with_prefix(self, prefix):
+        """A client for prompts that follow `prefix`, or None if this model can't hold one."""
+        if self.prefix_cache is None:
+            return None
+        model = await self.prefix_cache.get(prefix)
+        return ModelClient(model, self.limiter, self.max_attempts, self.generation_config)
+
+    def _options(self, generation_config):
+        config = generation_config or self.generation_config
+        return {"generation_config": config} if config else {}
+
+    async def _chunks(self, prompt, options):
+        if hasattr(self.model, "generate_content_async"):
+            async for chunk in await self.model.generate_content_async(prompt, stream=True, **options):
+                yield chunk
+        else:
+            # Blocking models can't stream; the whole reply is one chunk
+            yield await self._call(prompt, options)
+
+    async def _call(self, prompt, options):
+        if hasattr(self.model, "generate_content_async"):
+            return await self.model.generate_content_async(prompt, **options)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(self.model.generate_content, prompt, **options))
+
+    async def generate_content(self, prompt, on_retry=None, generation_config=None):
+        """Sends one request. on_retry(delay) is called before each rate-limit retry."""
+        options = self._options(generation_config)
+        estimate = estimate_tokens(prompt)
+        for attempt in range(self.max_attempts):
+            await self.limiter.acquire(estimate)
+            response = None
+            error = None
+            try:
+                response = await self._call(prompt, options)
+            except Exception as e:
+                error = e
+            finally:
+                throttled = error is not None and is_rate_limit_error(error)
+                usage = getattr(response, "usage_metadata", None)
+                await self.limiter.release(
+                    succeeded=response is not None,
+                    throttled=throttled,
+                    retry_after=retry_after_hint(error) if throttled else None,
+                    tokens_used=getattr(usage, "total_token_count", None),
+                    tokens_estimated=estimate,
+                )
+
+            if error is None:
+                return response
+            if not throttled:
+                raise error
+
+            delay = self.limiter.backoff(attempt, retry_after_hint(error))
+            if attempt == self.max_attempts - 1 or delay > self.limiter.max_wait:
+                raise RateLimitExceeded(f"Gemini rate limit persists, giving up after {attempt + 1} attempts.", retry_after=delay)
+            if on_retry:
+                on_retry(delay)
+            await asyncio.sleep(delay)
+
+    async def stream_content(self, prompt, on_retry=None, generation_config=None):
+        """
+        Like generate_content(), but yields response chunks as they arrive.
+
+        A rate limit hit before the first chunk is retried the same way; once
+        chunks have been yielded the error is raised to the caller. Closing
+        the generator early abandons the stream and frees its limiter slot.
+        """
+        options = self._options(generation_config)
+        estimate = estimate_tokens(prompt)
+        for attempt in range(self.max_attempts):
+            await self.limiter.acquire(estimate)
+            usage = None
+            received = False
+            completed = False
+            error = None
+            try:
+                async for chunk in self._chunks(prompt, options):
+                    received = True
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    yield chunk
+                completed = True
+            except Exception as e:
+                error = e
+            finally:
+                throttled = error is not None and is_rate_limit_error(error)
+                await self.limiter.release(
+                    succeeded=completed,
+                    throttled=throttled,
+                    retry_after=retry_after_hint(error) if throttled else None,
+                    tokens_used=getattr(usage, "total_token_count", None),
+                    tokens_estimated=estimate,
+                )
+
+            if error is None:
+                return
+            if not throttled or received:
+                raise error
+
+            delay = self.limiter.backoff(attempt, retry_after_hint(error))
+            if attempt == self.max_attempts - 1 or delay > self.limiter.max_wait:
+                raise RateLimitExceeded(f"Gemini rate limit persists, giving up after {attempt + 1} attempts.", retry_after=delay)
+            if on_retry:
+                on_retry(delay)
+            await asyncio.sleep(delay)
+
+async def preload_sdk():
+    """Imports the Gemini SDK on a worker thread so the first task doesn't stall the event loop on it."""
+    await asyncio.to_thread(importlib.import_module, "google.generativeai")
+
+def _gemini_prefix_model(model, cache_client, prefix, ttl):
+    """
+    A copy of `model` that starts every request with `prefix`. Prefixes big
+    enough are stored as an explicit context cache for `ttl` seconds; smaller
+    ones (or a refused cache) become the system instruction, which keeps the
+    prefix stable and first so the API's implicit caching can apply.
+    """
+    import google.generativeai as genai
+    from google.generativeai import caching
+
+    bound = None
+    if estimate_tokens([prefix]) >= MIN_CACHE_TOKENS:
+        try:
+            # Through this key's cache client rather than the process-wide default
+            request = caching.CachedContent._prepare_create_request(model=model.model_name, system_instruction=prefix, ttl=ttl)
+            cached = caching.CachedContent._from_obj(cache_client.create_cached_content(request))
+            bound = genai.GenerativeModel.from_cached_content(cached)
+        except Exception as e:
+            print(f"[WARNING] Context cache unavailable, sending the prefix with each request: {e}")
+    if bound is None:
+        bound = genai.GenerativeModel(model.model_name, system_instruction=prefix)
+    bound._client = model._client
+    bound._async_client = model._async_client
+    return bound
+
+def gemini_client(api_key, model_name):
+    """Configures the Gemini SDK and returns a client for model_name."""
+    import google.generativeai as genai
+    from google.generativeai import client
+    from reply import STEP_CONFIG
+
+    genai.configure(api_key=api_key)
+    model = genai.GenerativeModel(model_name)
+    # configure() is process-wide, so bind this key's clients to the model now;
+    # otherwise another session configuring a different key would take over.
+    model._client = client.get_default_generative_client()
+    model._async_client = client.get_default_generative_async_client()
+    bind = functools.partial(_gemini_prefix_model, model, client.get_default_cache_client())
+    return ModelClient(model, generation_config=STEP_CONFIG, prefix_cache=PrefixCache(bind))
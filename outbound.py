@@ -0,0 +1,159 @@
+import json
+import hashlib
+import asyncio
+from collections import deque
+
+class ClientChannel:
+    """
+    Outbound message queue for one websocket client.
+
+    send() never blocks: it appends to the queue and returns, and a dedicated
+    sender task delivers messages in batches gathered over `batch_window`
+    seconds. A slow client therefore only delays itself. Once more than
+    `max_logs` log lines are waiting, the oldest ones are dropped (and the
+    client is told how many). Only the newest timing message is kept, since
+    each replaces the last on screen; every other message, such as status,
+    is always delivered.
+
+    Clients that turned on the live view (watch()) also get the agent's
+    frames as binary messages, sent by the same task so they never interleave
+    with a text send. Only the newest offered frame is kept; it goes out once
+    the client has acked the previous one (frame_ack()) and at most `max_fps`
+    times a second, so the rate follows what the client can draw. Frames
+    whose JPEG is byte-for-byte the last one sent are skipped. A client
+    that never acks gets its credit back after `ack_timeout` seconds.
+    """
+    def __init__(self, websocket, max_logs=200, batch_window=0.05, max_fps=4, ack_timeout=3.0):
+        self.websocket = websocket
+        self.max_logs = max_logs
+        self.batch_window = batch_window
+        self.max_fps = max_fps
+        self.ack_timeout = ack_timeout
+        self.closed = False
+        self.watching = False
+        self._queue = deque()
+        self._logs = 0
+        self._dropped = 0
+        self._frame = None # Newest frame not yet considered for sending
+        self._sent_key = None # Digest of the last JPEG sent
+        self._sent_at = float("-inf")
+        self._acked = True # One frame in flight at a time
+        self._wakeup = None
+        self._ready = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def close(self):
+        self.closed = True
+        self._frame = None
+        if self._wakeup:
+            self._wakeup.cancel()
+        if self._task:
+            self._task.cancel()
+
+    def send(self, payload):
+        if self.closed:
+            return
+        if payload.get("type") == "timing":
+            self._drop_queued("timing")
+        self._queue.append(payload)
+        if payload.get("type") == "log":
+            self._logs += 1
+            if self._logs > self.max_logs:
+                self._drop_oldest_log()
+        self._ready.set()
+
+    def send_frame(self, frame):
+        """Offers the agent's latest Frame; replaces any frame still waiting."""
+        if self.closed:
+            return
+        self._frame = frame
+        if self.watching:
+            self._ready.set()
+
+    def watch(self, enabled):
+        self.watching = enabled
+        if enabled:
+            self._sent_key = None # A returning viewer needs the current frame even if unchanged
+            self._ready.set()
+
+    def frame_ack(self):
+        self._acked = True
+        if self._frame is not None:
+            self._ready.set()
+
+    def _wake_in(self, delay):
+        if self._wakeup:
+            self._wakeup.cancel()
+        self._wakeup = asyncio.get_running_loop().call_later(delay, self._ready.set)
+
+    @staticmethod
+    def _encode(frame):
+        # The grid view is the one the agent already encoded for the model.
+        # Compared by its bytes: typed text or an error line barely moves a dhash
+        data = frame.grid_jpeg
+        return hashlib.sha1(data).digest(), data
+
+    async def _send_frame(self):
+        if not self.watching or self._frame is None:
+            return
+        now = asyncio.get_running_loop().time()
+        if not self._acked:
+            if now - self._sent_at < self.ack_timeout:
+                self._wake_in(self._sent_at + self.ack_timeout - now)
+                return
+            self._acked = True # Ack lost, or the client stopped reading for a while
+        wait = self._sent_at + 1 / self.max_fps - now
+        if wait > 0:
+            self._wake_in(wait)
+            return
+        frame, self._frame = self._frame, None
+        key, data = await asyncio.to_thread(self._encode, frame)
+        if key == self._sent_key:
+            return
+        self._sent_key = key
+        self._sent_at = asyncio.get_running_loop().time()
+        self._acked = False
+        await self.websocket.send_bytes(data)
+
+    def _drop_queued(self, type):
+        for i, queued in enumerate(self._queue):
+            if queued.get("type") == type:
+                del self._queue[i]
+                return
+
+    def _drop_oldest_log(self):
+        for i, queued in enumerate(self._queue):
+            if queued.get("type") == "log":
+                del self._queue[i]
+                self._logs -= 1
+                self._dropped += 1
+                return
+
+    def _take_batch(self):
+        batch = list(self._queue)
+        self._queue.clear()
+        self._logs = 0
+        if self._dropped:
+            batch.insert(0, {"type": "log", "message": f"{self._dropped} log lines dropped (client too slow).", "logType": "warning"})
+            self._dropped = 0
+        return batch
+
+    async def _run(self):
+        try:
+            while True:
+                await self._ready.wait()
+                await asyncio.sleep(self.batch_window) # Coalesce bursts into one frame
+                self._ready.clear()
+                batch = self._take_batch()
+                if batch:
+                    payload = batch[0] if len(batch) == 1 else {"type": "batch", "messages": batch}
+                    await self.websocket.send_text(json.dumps(payload))
+                await self._send_frame()
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # Client went away; stop queueing for it
+            self.closed = True
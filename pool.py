@@ -0,0 +1,183 @@
+import time
+import asyncio
+import uuid
+from agent import WebAgent
+from model_client import preload_sdk
+
+class Job:
+    """A queued task and the connection it reports back to."""
+    def __init__(self, task, api_key, send, timing=False, send_frame=None):
+        self.id = uuid.uuid4().hex[:8]
+        self.task = task
+        self.api_key = api_key
+        self.send = send # Non-blocking callable taking a message dict, owned by the submitter
+        self.wants_timing = timing # Send a per-step latency breakdown along with the logs
+        self.send_frame = send_frame # Non-blocking callable taking each captured Frame, for a live view
+        self.agent = None
+        self.cancelled = False
+        self.finished = False
+
+    def log(self, message, type="info"):
+        self.send({"type": "log", "message": message, "logType": type, "session_id": self.id})
+
+    def status(self, status):
+        self.send({"type": "status", "status": status, "session_id": self.id})
+
+    def timing(self, step, stages, total):
+        self.send({"type": "timing", "step": step, "stages": stages, "total": total, "session_id": self.id})
+
+    def frame(self, frame):
+        self.send_frame(frame)
+
+    def pause(self):
+        if self.agent:
+            self.agent.pause()
+
+    def resume(self):
+        if self.agent:
+            self.agent.resume()
+
+    def stop(self):
+        """Stops the job whether it is still queued or already running."""
+        self.cancelled = True
+        if self.agent:
+            self.agent.stop()
+
+class AgentPool:
+    """
+    Runs tasks on a fixed set of isolated agents.
+
+    With size 1 the single agent keeps the persistent Edge profile, as before.
+    With more, one browser is shared and every agent gets its own context, so
+    cookies, pages and history never leak between sessions. At most `size`
+    tasks run at once; up to `max_queue` more wait, and submit() refuses the
+    rest. Contexts whose JS heap grows past `memory_limit_mb` are recycled
+    between tasks. `agent_options` are passed to every WebAgent.
+
+    Browsers are launched (headless if asked) and the Gemini SDK imported
+    concurrently at startup, so the first task doesn't pay for either; an
+    agent whose browser was closed or recycled is warmed up again as soon as
+    its task ends rather than when the next one arrives.
+    """
+    def __init__(self, size=1, max_queue=8, memory_limit_mb=None, headless=False, agent_options=None):
+        self.size = size
+        self.agent_options = agent_options or {}
+        self.memory_limit_mb = memory_limit_mb
+        self.headless = headless
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.agents = []
+        self.playwright = None
+        self.browser = None
+        self._workers = []
+        self.started_at = None
+        self.ready_after = None # Seconds from start() until the first agent had a browser
+
+    async def start(self):
+        self.started_at = time.perf_counter()
+        sdk = asyncio.create_task(preload_sdk())
+        if self.size > 1:
+            from playwright.async_api import async_playwright # Deferred to keep server startup fast
+            args = []
+            if self.memory_limit_mb:
+                args.append(f"--js-flags=--max-old-space-size={self.memory_limit_mb}")
+            self.playwright = await async_playwright().start()
+            self.browser = await self.playwright.chromium.launch(channel="msedge", headless=self.headless, args=args)
+
+        for i in range(self.size):
+            agent = WebAgent(browser=self.browser, session_id=i if self.browser else None, headless=self.headless, **self.agent_options)
+            self.agents.append(agent)
+            self._workers.append(asyncio.create_task(self._worker(agent)))
+
+        results = await asyncio.gather(sdk, *(self._warm(agent) for agent in self.agents), return_exceptions=True)
+        if isinstance(results[0], Exception):
+            print(f"[WARNING] Could not preload the Gemini SDK: {results[0]}")
+        for agent, result in zip(self.agents, results[1:]):
+            if isinstance(result, Exception):
+                print(f"[ERROR] Could not start browser for session {agent.session_id}: {result}")
+
+    async def _warm(self, agent):
+        """Brings up the agent's browser if it isn't running."""
+        if agent.page and agent.page.is_closed():
+            # The user closed the window; drop what's left of the context first
+            try:
+                await agent.stop_browser()
+            except Exception:
+                agent.page = None
+        await agent.ensure_browser()
+        if self.ready_after is None:
+            self.ready_after = time.perf_counter() - self.started_at
+
+    def status(self):
+        ready = sum(1 for agent in self.agents if agent.page and not agent.page.is_closed())
+        return {
+            "agents": self.size,
+            "ready": ready,
+            "busy": sum(1 for agent in self.agents if agent.logger),
+            "queued": self.queue.qsize(),
+            "startup_seconds": self.ready_after,
+        }
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        for agent in self.agents:
+            agent.stop()
+            await agent.stop_browser()
+        if self.browser:
+            await self.browser.close()
+        if self.playwright:
+            await self.playwright.stop()
+
+    def submit(self, task, api_key, send, timing=False, send_frame=None):
+        """Queues a task. Raises asyncio.QueueFull when the server is saturated."""
+        job = Job(task, api_key, send, timing, send_frame)
+        self.queue.put_nowait(job)
+        return job
+
+    async def _worker(self, agent):
+        while True:
+            job = await self.queue.get()
+            if job.cancelled:
+                job.finished = True
+                continue
+
+            job.agent = agent
+            agent.logger = job.log
+            agent.on_timing = job.timing if job.wants_timing else None
+            agent.on_frame = job.frame if job.send_frame else None
+            agent.history = [] # Never carry one session's history into another
+            agent.paused = False
+            agent.stopped = False
+            job.status("running")
+            try:
+                await agent.run(job.task, api_key=job.api_key)
+            except Exception as e:
+                job.log(f"Agent error: {str(e)}", "error")
+            finally:
+                job.agent = None
+                job.finished = True
+                agent.logger = None
+                agent.on_timing = None
+                agent.on_frame = None
+                job.status("idle")
+                await self._enforce_memory(agent)
+                try:
+                    await self._warm(agent)
+                except Exception as e:
+                    print(f"[WARNING] Could not restart browser for session {agent.session_id}: {e}")
+
+    async def _enforce_memory(self, agent):
+        """Restarts the agent's browser context if it uses too much JS heap."""
+        if not self.memory_limit_mb or not agent.page:
+            return
+        try:
+            cdp = await agent.context.new_cdp_session(agent.page)
+            metrics = await cdp.send("Performance.getMetrics")
+            await cdp.detach()
+        except Exception:
+            return
+        heap = next((m["value"] for m in metrics["metrics"] if m["name"] == "JSHeapTotalSize"), 0)
+        if heap / (1024 * 1024) > self.memory_limit_mb:
+            print(f"[WARNING] Session {agent.session_id} over memory limit, recycling browser context.")
+            await agent.stop_browser()
+            await agent.start_browser()
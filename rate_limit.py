@@ -0,0 +1,142 @@
+import os
+import re
+import time
+import random
+import asyncio
+
+class RateLimitExceeded(Exception):
+    """Raised instead of blocking when the Gemini quota can't be met in time."""
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def is_rate_limit_error(exc):
+    return "429" in str(exc) or "ResourceExhausted" in str(exc) or type(exc).__name__ == "ResourceExhausted"
+
+def retry_after_hint(exc):
+    """Seconds the server asked us to wait, if the error says."""
+    hint = getattr(exc, "retry_after", None)
+    if hint is not None:
+        return float(hint)
+    text = str(exc)
+    match = re.search(r"retry in ([\d.]+)\s*s", text, re.IGNORECASE) or re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", text)
+    return float(match.group(1)) if match else None
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `per_minute` / 60 per second."""
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount):
+        """Seconds until `amount` is available (requests larger than the bucket wait for a full one)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def consume(self, amount):
+        self._refill()
+        self.level -= amount # May go negative when correcting an estimate
+
+class RateLimiter:
+    """
+    Process-wide limiter shared by every agent's model client.
+
+    Requests and tokens per minute are enforced with token buckets. The number
+    of concurrent requests adapts AIMD-style: it grows by one per `limit`
+    successes and halves on every 429, when all callers also pause for the
+    server's retry hint. If a request could not start within `max_wait`
+    seconds, acquire() raises RateLimitExceeded right away instead of waiting.
+    """
+    def __init__(self, rpm=None, tpm=None, max_concurrency=8, min_concurrency=1, max_wait=30.0):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.max_wait = max_wait
+        self.active = 0
+        self.cooldown_until = 0.0
+        self.stats = {"requests": 0, "throttled": 0, "rejected": 0}
+        self._changed = asyncio.Condition()
+
+    def _delay(self, tokens):
+        delay = max(0.0, self.cooldown_until - time.monotonic())
+        if self.requests:
+            delay = max(delay, self.requests.delay(1))
+        if self.tokens:
+            delay = max(delay, self.tokens.delay(tokens))
+        return delay
+
+    def _reject(self, wait):
+        self.stats["rejected"] += 1
+        raise RateLimitExceeded(f"Gemini quota exhausted, next request possible in {wait:.0f}s.", retry_after=wait)
+
+    async def acquire(self, tokens=0):
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            delay = self._delay(tokens)
+            if delay == 0:
+                break
+            if time.monotonic() + delay > deadline:
+                self._reject(delay)
+            await asyncio.sleep(delay)
+
+        async with self._changed:
+            while self.active >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._reject(self.max_wait)
+                try:
+                    await asyncio.wait_for(self._changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            self.active += 1
+
+        if self.requests:
+            self.requests.consume(1)
+        if self.tokens:
+            self.tokens.consume(tokens)
+        self.stats["requests"] += 1
+
+    async def release(self, succeeded=True, throttled=False, retry_after=None, tokens_used=None, tokens_estimated=0):
+        if self.tokens and tokens_used is not None:
+            self.tokens.consume(tokens_used - tokens_estimated)
+        if throttled:
+            self.stats["throttled"] += 1
+            self.limit = max(self.min_concurrency, self.limit / 2)
+            if retry_after:
+                self.cooldown_until = max(self.cooldown_until, time.monotonic() + retry_after)
+        elif succeeded:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        async with self._changed:
+            self.active -= 1
+            self._changed.notify_all()
+
+    def backoff(self, attempt, retry_after=None, base=1.0, cap=30.0):
+        """Full-jitter exponential backoff, never shorter than the server's hint."""
+        delay = random.uniform(0, min(cap, base * 2 ** attempt))
+        return max(delay, retry_after or 0)
+
+_shared = None
+
+def shared_limiter():
+    """The limiter every agent in this process uses, configured from the environment."""
+    global _shared
+    if _shared is None:
+        rpm = os.getenv("GEMINI_RPM")
+        tpm = os.getenv("GEMINI_TPM")
+        _shared = RateLimiter(
+            rpm=int(rpm) if rpm else None,
+            tpm=int(tpm) if tpm else None,
+            max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")),
+            max_wait=float(os.getenv("GEMINI_MAX_WAIT", "30")),
+        )
+    return _shared
@@ -0,0 +1,183 @@
+import re
+import json
+import math
+from utils import SYSTEM_PROMPT, FAN_OUT_RULES
+
+class ReplyError(ValueError):
+    """The model's reply couldn't be turned into a step, even after repair."""
+
+# How each step reply was made usable: parsed as is, repaired locally,
+# re-asked for, or given up on
+PARSE_OUTCOMES = ("clean", "repaired", "reprompted", "failed")
+
+# Action names as listed in the prompts, e.g. "1. click(x, y): ..."
+ACTIONS = re.findall(r"^\d+\.\s*(\w+)\(", SYSTEM_PROMPT + FAN_OUT_RULES, re.MULTILINE)
+
+# How many leading params are text; the rest are numbers (coordinates or element ids)
+TEXT_PARAMS = {"type": 1, "paste": 1, "scroll": 1, "finish": 1, "ask_user": 1, "split": math.inf}
+
+REPAIR_PROMPT = """
+Your previous reply could not be used: {error}
+Previous reply:
+{reply}
+
+Send the same decision again as ONLY a JSON object in this format, with no other text:
+{{"thought": "...", "actions": [{{"action": "click", "params": [450, 210]}}]}}
+Valid actions: {actions}.
+"""
+
+# JSON mode, without a response_schema: Gemini orders schema properties
+# alphabetically, which would put "actions" before "thought" and have the
+# model pick coordinates before reasoning about the screen. Replies are
+# checked by repair_json() and normalize_reply() instead.
+STEP_CONFIG = {"response_mime_type": "application/json"}
+
+# Zoom refinement answers with a bare point
+POINT_CONFIG = {"response_mime_type": "application/json"}
+
+def strip_fences(text):
+    text = text.strip()
+    if "```json" in text:
+        text = text.split("```json")[-1].split("```")[0].strip()
+    elif "```" in text:
+        text = text.split("```")[1].strip() # Between the first fence and the next (or the end)
+    return text
+
+def _close(text):
+    """Appends the quotes and brackets `text` leaves open, or None if it closes too many."""
+    stack = []
+    in_string = escape = False
+    for c in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in "{[":
+            stack.append("}" if c == "{" else "]")
+        elif c in "}]":
+            if not stack or stack.pop() != c:
+                return None
+    tail = '"' if in_string else ""
+    return text + tail + "".join(reversed(stack))
+
+def _cut_points(text):
+    """Offsets of the commas outside strings, latest first."""
+    points = []
+    in_string = escape = False
+    for i, c in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == ",":
+            points.append(i)
+    return reversed(points)
+
+def repair_json(text, max_cuts=20):
+    """
+    Parses a model reply, recovering common damage. Returns (value, outcome)
+    with outcome "clean" or "repaired"; raises ReplyError if nothing works.
+
+    Recovers code fences, text before or after the JSON, and replies cut
+    off mid-way (unclosed strings and brackets, dropping a trailing
+    incomplete item if needed).
+    """
+    text = strip_fences(text)
+    try:
+        return json.loads(text), "clean"
+    except ValueError as e:
+        error = e
+
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        raise ReplyError(f"no JSON found ({error})")
+    text = text[min(starts):]
+    try:
+        # Trailing text after a complete value
+        return json.JSONDecoder().raw_decode(text)[0], "repaired"
+    except ValueError:
+        pass
+
+    candidates = [text] + [text[:i] for i in _cut_points(text)][:max_cuts]
+    for candidate in candidates:
+        closed = _close(candidate.rstrip().rstrip(",:"))
+        if closed is None:
+            continue
+        try:
+            return json.loads(closed), "repaired"
+        except ValueError:
+            continue
+    raise ReplyError(f"invalid JSON ({error})")
+
+def _coerce(action, params):
+    text_count = TEXT_PARAMS.get(action, 0)
+    coerced = []
+    for i, value in enumerate(params):
+        if i >= text_count and isinstance(value, str):
+            try:
+                value = float(value)
+                value = int(value) if value.is_integer() else value
+            except ValueError:
+                pass
+        coerced.append(value)
+    return coerced
+
+def normalize_action(act):
+    """One action with its params converted back from strings, or None if it isn't a known action."""
+    if not isinstance(act, dict) or act.get("action") not in ACTIONS:
+        return None
+    params = act.get("params", [])
+    if not isinstance(params, list):
+        params = [params]
+    coerced = _coerce(act["action"], params)
+    if coerced != act.get("params"):
+        act = {**act, "params": coerced}
+    return act
+
+def normalize_reply(value):
+    """
+    Turns a parsed reply into {"thought", "actions": [...]}. Accepts the
+    single-action form, a bare list of actions and a lone action object,
+    and converts numeric params sent as strings back into numbers. An empty
+    list is a valid no-op step. Returns (reply, changed); raises ReplyError
+    if actions were given but none of them is valid.
+    """
+    changed = False
+    if isinstance(value, list):
+        value, changed = {"thought": "", "actions": value}, True
+    if not isinstance(value, dict):
+        raise ReplyError("reply is not a JSON object")
+    actions = value.get("actions")
+    if actions is None and value.get("action"):
+        actions, changed = [{"action": value["action"], "params": value.get("params", [])}], True
+    if isinstance(actions, dict):
+        actions, changed = [actions], True
+    if not isinstance(actions, list):
+        raise ReplyError('missing "actions" list')
+
+    valid = []
+    for act in actions:
+        normalized = normalize_action(act)
+        if normalized is None:
+            changed = True
+            continue
+        valid.append(normalized)
+    if actions and not valid:
+        raise ReplyError(f"no valid action (expected one of {', '.join(ACTIONS)})")
+    reply = {**value, "thought": value.get("thought", "None"), "actions": valid}
+    reply.pop("action", None)
+    reply.pop("params", None)
+    return reply, changed
+
+def repair_prompt(error, text):
+    return REPAIR_PROMPT.format(error=error, reply=text[:2000], actions=", ".join(ACTIONS))
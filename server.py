@@ -1,8 +1,15 @@
 import asyncio
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import os
+import re
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import HTMLResponse, FileResponse, PlainTextResponse
 import json
-from agent import WebAgent
+from pool import AgentPool
+from journal import RunJournal
+from artifacts import ARTIFACT_KEY, shared_store
+from outbound import ClientChannel
+from metrics import metrics
 
 app = FastAPI()
 
@@ -14,95 +21,145 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global agent instance
-agent = None
-# Active WebSocket connections
-active_connections = []
+# Agent pool shared by all connections. Each task runs on its own isolated
+# agent and only reports back to the websocket that submitted it.
+pool = None
 
 @app.on_event("startup")
 async def startup_event():
-    global agent
-    agent = WebAgent(logger=broadcast_log)
-    # Start the browser immediately
-    asyncio.create_task(agent.start_browser())
-
-async def broadcast_log(message, type="info"):
-    dead_connections = []
-    payload = json.dumps({"type": "log", "message": message, "logType": type})
-    for websocket in active_connections:
-        try:
-            await websocket.send_text(payload)
-        except:
-            dead_connections.append(websocket)
-    
-    for dead in dead_connections:
-        if dead in active_connections:
-            active_connections.remove(dead)
-
-async def broadcast_status(status):
-    """Broadcast agent status (idle/running) to all clients."""
-    dead_connections = []
-    payload = json.dumps({"type": "status", "status": status})
-    for websocket in active_connections:
-        try:
-            await websocket.send_text(payload)
-        except:
-            dead_connections.append(websocket)
-    
-    for dead in dead_connections:
-        if dead in active_connections:
-            active_connections.remove(dead)
+    global pool
+    memory_limit = os.getenv("AGENT_MEMORY_LIMIT_MB")
+    pool = AgentPool(
+        size=int(os.getenv("AGENT_POOL_SIZE", "1")),
+        max_queue=int(os.getenv("AGENT_MAX_QUEUE", "8")),
+        memory_limit_mb=int(memory_limit) if memory_limit else None,
+        headless=os.getenv("AGENT_HEADLESS", "0") == "1",
+        agent_options={
+            "debug_capture": os.getenv("AGENT_DEBUG_CAPTURE", "full"),
+            "frame_policy": os.getenv("AGENT_FRAME_POLICY", "adaptive"),
+            "zoom": os.getenv("AGENT_ZOOM", "auto"),
+            "perception": os.getenv("AGENT_PERCEPTION", "screenshot"),
+            "frame_source": os.getenv("AGENT_FRAME_SOURCE", "screencast"),
+            "replay": os.getenv("AGENT_REPLAY", "1") != "0",
+            "streaming": os.getenv("AGENT_STREAMING", "1") != "0",
+            "fan_out": os.getenv("AGENT_FAN_OUT", "1") != "0",
+            "max_branches": int(os.getenv("AGENT_MAX_BRANCHES", "4")),
+        },
+    )
+    # Start the browser(s) immediately
+    asyncio.create_task(pool.start())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if pool:
+        await pool.close()
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    active_connections.append(websocket)
+    # Everything for this client goes through its own bounded queue, so a
+    # slow client never holds up the agent or other clients
+    channel = ClientChannel(websocket)
+    channel.start()
+    job = None # The task this connection owns, if any
+
+    def send_log(message, type="info"):
+        channel.send({"type": "log", "message": message, "logType": type})
+
     try:
         while True:
             data = await websocket.receive_text()
             # Handle incoming messages if needed
             message = json.loads(data)
             if message.get("type") == "start_task":
+                if job and not job.finished and not job.cancelled:
+                    send_log("A task is already running in this session.", "warning")
+                    continue
                 task = message.get("task")
                 api_key = message.get("api_key")
-                asyncio.create_task(run_agent_task(task, api_key))
+                try:
+                    job = pool.submit(task, api_key, channel.send, timing=bool(message.get("timing")),
+                                      send_frame=channel.send_frame)
+                except asyncio.QueueFull:
+                    send_log("Server is busy, too many queued tasks. Try again later.", "error")
+                    continue
+                channel.send({"type": "status", "status": "queued", "session_id": job.id})
+                send_log(f"Starting task: {task}", "info")
             elif message.get("type") == "pause":
-                if agent:
-                    agent.paused = True
-                    await broadcast_log("Agent paused.", "warning")
+                if job:
+                    job.pause()
+                    send_log("Agent paused.", "warning")
             elif message.get("type") == "resume":
-                if agent:
-                    agent.paused = False
-                    await broadcast_log("Agent resumed.", "info")
+                if job:
+                    job.resume()
+                    send_log("Agent resumed.", "info")
             elif message.get("type") == "stop":
-                if agent:
-                    agent.stopped = True
-                    await broadcast_log("Agent stopping...", "warning")
+                if job:
+                    job.stop()
+                    send_log("Agent stopping...", "warning")
+            elif message.get("type") == "live_view":
+                channel.watch(bool(message.get("enabled")))
+            elif message.get("type") == "frame_ack":
+                channel.frame_ack()
             elif message.get("type") == "reset":
-                if agent:
-                    agent.stopped = True
-                    agent.history = []
-                    await broadcast_log("Agent reset. History cleared.", "warning")
+                if job:
+                    job.stop()
+                    job = None
+                send_log("Agent reset. History cleared.", "warning")
     except WebSocketDisconnect:
-        if websocket in active_connections:
-            active_connections.remove(websocket)
-
-async def run_agent_task(task, api_key=None):
-    global agent
-    await broadcast_status("running")
-    await broadcast_log(f"Starting task: {task}", "info")
-    try:
-        if not agent:
-            agent = WebAgent(logger=broadcast_log)
-        await agent.run(task, api_key=api_key)
-    except Exception as e:
-        await broadcast_log(f"Agent error: {str(e)}", "error")
+        # Nobody is left to watch or control the task
+        if job:
+            job.stop()
     finally:
-        await broadcast_status("idle")
+        channel.close()
 
 @app.get("/health")
 async def health():
-    return {"status": "ok"}
+    """Answers as soon as the server is up; "ready" counts agents whose browser is running."""
+    if not pool:
+        return {"status": "starting"}
+    return {"status": "ok", **pool.status()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Stage timings and counters for every agent, in Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+ARTIFACTS_ROOT = os.path.join(os.getcwd(), "debug", "artifacts")
+
+def run_dir(run_id):
+    if not re.fullmatch(r"[\w-]+", run_id):
+        raise HTTPException(status_code=404)
+    path = os.path.join(os.getcwd(), "debug", f"run_{run_id}")
+    if not os.path.isdir(path):
+        raise HTTPException(status_code=404)
+    return path
+
+@app.get("/runs/{run_id}", response_class=HTMLResponse)
+async def run_report(run_id: str):
+    """Renders a run's report from its journal, including runs still in progress."""
+    journal = RunJournal(run_dir(run_id), run_id)
+    def asset_url(key):
+        # Store keys, or file names in the run directory for older runs
+        return f"/artifacts/{key}" if ARTIFACT_KEY.fullmatch(key) else f"/runs/{run_id}/{key}"
+    return await asyncio.to_thread(journal.render_html, asset_url)
+
+@app.get("/artifacts/{key}")
+async def artifact(key: str):
+    """A debug image from the content-addressed store; the key never changes, so it can be cached for good."""
+    if not ARTIFACT_KEY.fullmatch(key):
+        raise HTTPException(status_code=404)
+    path = shared_store(ARTIFACTS_ROOT).path(key)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404)
+    return FileResponse(path, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.get("/runs/{run_id}/{artifact}")
+async def run_artifact(run_id: str, artifact: str):
+    path = os.path.join(run_dir(run_id), os.path.basename(artifact))
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404)
+    return FileResponse(path)
 
 if __name__ == "__main__":
     import uvicorn
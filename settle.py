@@ -0,0 +1,103 @@
+import time
+import asyncio
+import hashlib
+
+# Installs a MutationObserver once per document and reports how long the
+# DOM has been quiet, in milliseconds.
+DOM_QUIET_SCRIPT = """
+() => {
+    if (!window.__agentLastMutation) {
+        window.__agentLastMutation = performance.now();
+        new MutationObserver(() => { window.__agentLastMutation = performance.now(); })
+            .observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+    }
+    return performance.now() - window.__agentLastMutation;
+}
+"""
+
+class PageSettler:
+    """
+    Waits until the page is stable after an action, instead of a fixed sleep.
+
+    A page counts as settled once the load event has fired, no requests are
+    in flight, the DOM has been quiet for `quiet` seconds and two consecutive
+    low-quality frames are identical. Pages that never settle (animations,
+    long polling) are given up on after `timeout` seconds, requests open for
+    longer than `request_grace` seconds are ignored, and the frame check is
+    skipped after `max_frame_checks` tries. With a streaming frame source
+    attached (`frames`), frame stability is read from its sequence number
+    instead of taking screenshots, once a frame has arrived since the action.
+    """
+    def __init__(self, timeout=5.0, quiet=0.3, poll=0.05, max_frame_checks=3, request_grace=2.0):
+        self.timeout = timeout
+        self.quiet = quiet
+        self.poll = poll
+        self.max_frame_checks = max_frame_checks
+        self.request_grace = request_grace
+        self.frames = None
+        self.stats = {} # action -> list of settle times in seconds
+        self._page = None
+        self._inflight = {}
+
+    def _track(self, page):
+        """Counts in-flight requests on `page` (listeners attach once per page)."""
+        if page is self._page:
+            return
+        self._page = page
+        self._inflight = inflight = {} # request -> start time
+        page.on("request", lambda request: inflight.__setitem__(request, time.perf_counter()))
+        page.on("requestfinished", lambda request: inflight.pop(request, None))
+        page.on("requestfailed", lambda request: inflight.pop(request, None))
+
+    def _network_idle(self):
+        now = time.perf_counter()
+        return all(now - started > self.request_grace for started in self._inflight.values())
+
+    async def _frame_digest(self, page):
+        if self.frames is not None and self.frames.streaming and self.frames.fresh:
+            return self.frames.seq
+        shot = await page.screenshot(type="jpeg", quality=20, scale="css")
+        return hashlib.sha1(shot).digest()
+
+    async def wait(self, page, action="action"):
+        """Returns once `page` is settled (or the timeout is hit) and records the time taken."""
+        self._track(page)
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        last_digest = None
+        frame_checks = 0
+
+        try:
+            await page.wait_for_load_state("load", timeout=self.timeout * 1000)
+        except Exception:
+            pass
+
+        while time.perf_counter() < deadline:
+            try:
+                dom_quiet_ms = await page.evaluate(DOM_QUIET_SCRIPT)
+            except Exception:
+                # Navigation replaced the document mid-check; start over on the new one
+                dom_quiet_ms = 0
+                last_digest = None
+
+            if self._network_idle() and dom_quiet_ms >= self.quiet * 1000:
+                if frame_checks >= self.max_frame_checks:
+                    break
+                digest = await self._frame_digest(page)
+                frame_checks += 1
+                if digest == last_digest:
+                    break
+                last_digest = digest
+
+            await asyncio.sleep(self.poll)
+
+        elapsed = time.perf_counter() - start
+        self.stats.setdefault(action, []).append(elapsed)
+        return elapsed
+
+    def summary(self):
+        """Per-action count, mean and max settle time."""
+        return {
+            action: {"count": len(times), "mean": sum(times) / len(times), "max": max(times)}
+            for action, times in self.stats.items()
+        }
@@ -0,0 +1,45 @@
+import copy
+import hashlib
+from collections import OrderedDict
+from history import encode_history
+
+# Decisions that end the step loop; the answer or question may differ even
+# on a page that looks the same, so they always come from the model
+UNCACHED_ACTIONS = {"finish", "ask_user"}
+
+def history_key(history, depth=3):
+    """Hashes the recent history exactly as the model is shown it (actions and outcomes)."""
+    return hashlib.sha1(encode_history(history, depth).encode()).hexdigest()
+
+class StepCache:
+    """
+    Bounded LRU of (task, URL, frame thumbprint, recent actions) -> parsed
+    model response, for a single run (the agent clears it in _start_run).
+
+    When the page and what the agent just did are both unchanged, the model
+    would see an identical request, so its earlier decision is reused instead
+    of paying for another round-trip. Replies that finish or ask the user
+    are never stored.
+    """
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def clear(self):
+        self._entries.clear()
+
+    def get(self, task, url, thumbprint, history):
+        key = (task, url, thumbprint, history_key(history))
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return copy.deepcopy(self._entries[key])
+
+    def put(self, task, url, thumbprint, history, response):
+        if any(act.get("action") in UNCACHED_ACTIONS for act in response.get("actions", [])):
+            return
+        key = (task, url, thumbprint, history_key(history))
+        self._entries[key] = copy.deepcopy(response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,97 @@
+import json
+
+class ActionParser:
+    """
+    Incremental scanner for a streamed {"thought": ..., "actions": [...]} reply.
+
+    feed() takes the next chunk of text and returns the events it completed:
+    ("thought", text) once the thought string closes, and ("action", dict)
+    for every object in the top-level "actions" array as soon as its closing
+    brace arrives. Anything before the first "{" (such as a ```json fence)
+    is skipped. Malformed items are left for the full parse at the end;
+    `text` holds everything received so far.
+    """
+    def __init__(self):
+        self.text = ""
+        self.thought = None
+        self._pos = 0
+        self._depth = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None # Raw top-level string, a key until a value follows ':'
+        self._key = None
+        self._expect_value = False
+        self._in_actions = False
+        self._item_start = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        events = []
+        text = self.text
+        while self._pos < len(text):
+            pos = self._pos
+            c = text[pos]
+            self._pos += 1
+
+            if not self._started:
+                if c == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._top_level_string(text[self._string_start:pos + 1], events)
+                continue
+
+            if c == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif c in "{[":
+                if self._depth == 1 and c == "[" and self._key == "actions":
+                    self._in_actions = True
+                elif self._depth == 2 and c == "{" and self._in_actions:
+                    self._item_start = pos
+                self._depth += 1
+                self._expect_value = False
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 2 and c == "}" and self._item_start is not None:
+                    try:
+                        events.append(("action", json.loads(text[self._item_start:pos + 1])))
+                    except ValueError:
+                        pass
+                    self._item_start = None
+                elif self._depth == 1 and c == "]":
+                    self._in_actions = False
+            elif self._depth == 1:
+                if c == ":":
+                    self._key = self._decode(self._last_string)
+                    self._expect_value = True
+                elif c == ",":
+                    self._expect_value = False
+        return events
+
+    def _top_level_string(self, raw, events):
+        if not self._expect_value:
+            self._last_string = raw
+            return
+        self._expect_value = False
+        if self._key == "thought" and self.thought is None:
+            self.thought = self._decode(raw)
+            events.append(("thought", self.thought))
+
+    @staticmethod
+    def _decode(raw):
+        try:
+            return json.loads(raw) if raw else None
+        except ValueError:
+            return None
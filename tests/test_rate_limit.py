@@ -0,0 +1,121 @@
+import asyncio
+import functools
+import pytest
+from fake_model import FakeModel, FakeResourceExhausted
+from model_client import ModelClient
+from rate_limit import RateLimiter, RateLimitExceeded, retry_after_hint
+
+def make_limiter(**options):
+    limiter = RateLimiter(**options)
+    # Same jittered backoff, scaled down so retries take milliseconds
+    limiter.backoff = functools.partial(limiter.backoff, base=0.001)
+    return limiter
+
+def test_retry_after_hint():
+    assert retry_after_hint(FakeResourceExhausted(2.5)) == 2.5
+    assert retry_after_hint(Exception("429 Quota exceeded. Please retry in 7s.")) == 7.0
+    assert retry_after_hint(Exception("retry_delay { seconds: 12 }")) == 12.0
+    assert retry_after_hint(Exception("500 Internal")) is None
+
+def test_limit_halves_on_throttle_and_grows_on_success():
+    async def run():
+        limiter = make_limiter(max_concurrency=8)
+        await limiter.acquire()
+        await limiter.release(throttled=True)
+        assert limiter.limit == 4
+        for _ in range(4):
+            await limiter.acquire()
+            await limiter.release()
+        assert limiter.limit == pytest.approx(5, abs=0.1)
+        assert limiter.active == 0
+    asyncio.run(run())
+
+def test_limit_never_drops_below_min_concurrency():
+    async def run():
+        limiter = make_limiter(max_concurrency=4, min_concurrency=1)
+        for _ in range(5):
+            await limiter.acquire()
+            await limiter.release(throttled=True)
+        assert limiter.limit == 1
+        assert limiter.stats["throttled"] == 5
+    asyncio.run(run())
+
+def test_concurrency_is_capped():
+    async def run():
+        limiter = make_limiter(max_concurrency=2)
+        running = peak = 0
+
+        async def request():
+            nonlocal running, peak
+            await limiter.acquire()
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            await limiter.release()
+
+        await asyncio.gather(*(request() for _ in range(6)))
+        assert peak == 2
+    asyncio.run(run())
+
+def test_token_budget_rejects_instead_of_waiting_past_max_wait():
+    async def run():
+        limiter = make_limiter(tpm=100, max_wait=1.0)
+        await limiter.acquire(100)
+        await limiter.release(tokens_used=100, tokens_estimated=100)
+        with pytest.raises(RateLimitExceeded):
+            await limiter.acquire(50) # 30s of refill away
+        assert limiter.stats["rejected"] == 1
+    asyncio.run(run())
+
+def test_client_retries_scripted_429s():
+    async def run():
+        model = FakeModel(["429", "429", {"thought": "ok", "actions": []}], retry_after=0.01)
+        limiter = make_limiter()
+        client = ModelClient(model, limiter)
+        delays = []
+        response = await client.generate_content(["hi"], on_retry=delays.append)
+        assert '"ok"' in response.text
+        assert model.calls == 3
+        assert len(delays) == 2 and all(d >= 0.01 for d in delays)
+        assert limiter.stats["throttled"] == 2
+        assert limiter.active == 0
+    asyncio.run(run())
+
+def test_client_gives_up_when_the_hint_exceeds_max_wait():
+    async def run():
+        model = FakeModel(["429"], retry_after=60)
+        client = ModelClient(model, make_limiter(max_wait=5))
+        with pytest.raises(RateLimitExceeded):
+            await client.generate_content(["hi"])
+        assert model.calls == 1
+    asyncio.run(run())
+
+def test_client_gives_up_after_max_attempts():
+    async def run():
+        model = FakeModel(["429"] * 5, retry_after=0.001)
+        client = ModelClient(model, make_limiter(), max_attempts=3)
+        with pytest.raises(RateLimitExceeded):
+            await client.generate_content(["hi"])
+        assert model.calls == 3
+    asyncio.run(run())
+
+def test_client_raises_other_errors_without_retrying():
+    async def run():
+        model = FakeModel([ValueError("bad request")])
+        limiter = make_limiter()
+        with pytest.raises(ValueError):
+            await ModelClient(model, limiter).generate_content(["hi"])
+        assert model.calls == 1
+        assert limiter.active == 0
+    asyncio.run(run())
+
+def test_stream_retries_429_before_the_first_chunk():
+    async def run():
+        model = FakeModel(["429", "a reply in several chunks"], retry_after=0.001, chunk_size=4)
+        client = ModelClient(model, make_limiter())
+        chunks = [chunk.text async for chunk in client.stream_content(["hi"])]
+        assert "".join(chunks) == "a reply in several chunks"
+        assert len(chunks) > 1
+        assert model.calls == 2
+    asyncio.run(run())
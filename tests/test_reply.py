@@ -0,0 +1,70 @@
+import pytest
+from reply import ReplyError, normalize_reply, repair_json
+
+CLICK = {"action": "click", "params": [1, 2]}
+
+def test_clean_reply():
+    assert repair_json('{"thought": "a", "actions": []}') == ({"thought": "a", "actions": []}, "clean")
+
+@pytest.mark.parametrize("text", [
+    '```json\n{"thought": "a", "actions": []}\n```',
+    '```\n{"thought": "a", "actions": []}\n```',
+])
+def test_fenced_reply_is_clean(text):
+    assert repair_json(text) == ({"thought": "a", "actions": []}, "clean")
+
+def test_text_around_the_json():
+    assert repair_json('Sure! {"thought": "a", "actions": []} Hope that helps.') == ({"thought": "a", "actions": []}, "repaired")
+
+def test_truncated_inside_a_string():
+    assert repair_json('{"thought": "cut here') == ({"thought": "cut here"}, "repaired")
+
+def test_truncated_item_is_dropped():
+    text = '{"thought": "a", "actions": [{"action": "click", "params": [1, 2]}, {"act'
+    assert repair_json(text) == ({"thought": "a", "actions": [CLICK]}, "repaired")
+
+def test_truncated_after_a_comma():
+    text = '{"thought": "a", "actions": [{"action": "click", "params": [1, 2]},'
+    assert repair_json(text) == ({"thought": "a", "actions": [CLICK]}, "repaired")
+
+@pytest.mark.parametrize("text", ["no json at all", "", '{"thought": ]'])
+def test_unrecoverable_reply_raises(text):
+    with pytest.raises(ReplyError):
+        repair_json(text)
+
+def test_normalize_keeps_a_well_formed_reply():
+    reply = {"thought": "t", "actions": [CLICK]}
+    assert normalize_reply(reply) == (reply, False)
+
+def test_normalize_accepts_an_empty_step():
+    assert normalize_reply({"thought": "waiting for results", "actions": []}) == ({"thought": "waiting for results", "actions": []}, False)
+
+def test_normalize_single_action_form():
+    reply, changed = normalize_reply({"thought": "t", "action": "click", "params": ["450", "210"]})
+    assert reply == {"thought": "t", "actions": [{"action": "click", "params": [450, 210]}]}
+    assert changed
+
+def test_normalize_bare_list_and_lone_action_object():
+    assert normalize_reply([CLICK]) == ({"thought": "", "actions": [CLICK]}, True)
+    reply, changed = normalize_reply({"thought": "t", "actions": {"action": "scroll", "params": "down"}})
+    assert reply["actions"] == [{"action": "scroll", "params": ["down"]}]
+    assert changed
+
+def test_normalize_converts_only_numeric_params():
+    reply, _ = normalize_reply({"thought": "t", "actions": [{"action": "type", "params": ["42", "1", "2.5"]}]})
+    assert reply["actions"][0]["params"] == ["42", 1, 2.5] # The text to type stays a string
+
+def test_normalize_drops_unknown_actions():
+    reply, changed = normalize_reply({"thought": "t", "actions": [{"action": "fly"}, {"action": "wait", "params": []}]})
+    assert reply["actions"] == [{"action": "wait", "params": []}]
+    assert changed
+
+@pytest.mark.parametrize("value", ["text", {"thought": "t"}, {"thought": "t", "actions": [{"action": "fly"}]}])
+def test_normalize_rejects_replies_without_a_valid_action(value):
+    with pytest.raises(ReplyError):
+        normalize_reply(value)
+
+def test_repaired_then_normalized():
+    value, outcome = repair_json('```json\n{"thought": "t", "action": "click", "params": ["5", "6"]')
+    assert outcome == "repaired"
+    assert normalize_reply(value)[0] == {"thought": "t", "actions": [{"action": "click", "params": [5, 6]}]}
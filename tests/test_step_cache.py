@@ -0,0 +1,46 @@
+from history import compact_step
+from step_cache import StepCache
+
+CLICK = {"thought": "t", "actions": [{"action": "click", "params": [1, 2]}]}
+HISTORY = [compact_step([{"action": "scroll", "params": ["down"]}])]
+
+def test_hit_on_identical_request():
+    cache = StepCache()
+    cache.put("task", "http://a/", "00ff", HISTORY, CLICK)
+    assert cache.get("task", "http://a/", "00ff", HISTORY) == CLICK
+
+def test_returns_copies():
+    cache = StepCache()
+    cache.put("task", "http://a/", "00ff", HISTORY, CLICK)
+    cache.get("task", "http://a/", "00ff", HISTORY)["actions"].clear()
+    assert cache.get("task", "http://a/", "00ff", HISTORY) == CLICK
+
+def test_miss_when_any_part_of_the_key_differs():
+    cache = StepCache()
+    cache.put("task", "http://a/", "00ff", HISTORY, CLICK)
+    assert cache.get("other task", "http://a/", "00ff", HISTORY) is None
+    assert cache.get("task", "http://b/", "00ff", HISTORY) is None
+    assert cache.get("task", "http://a/", "00fe", HISTORY) is None
+    assert cache.get("task", "http://a/", "00ff", []) is None
+
+def test_history_outcome_is_part_of_the_key():
+    changed = [{**HISTORY[0], "result": "page changed"}]
+    cache = StepCache()
+    cache.put("task", "http://a/", "00ff", HISTORY, CLICK)
+    assert cache.get("task", "http://a/", "00ff", changed) is None
+
+def test_final_decisions_are_never_stored():
+    cache = StepCache()
+    for action in ("finish", "ask_user"):
+        reply = {"thought": "t", "actions": [{"action": "scroll", "params": ["down"]}, {"action": action, "params": ["x"]}]}
+        cache.put("task", "http://a/", "00ff", HISTORY, reply)
+        assert cache.get("task", "http://a/", "00ff", HISTORY) is None
+
+def test_clear_and_lru_eviction():
+    cache = StepCache(max_entries=2)
+    for n in range(3):
+        cache.put("task", f"http://{n}/", "00ff", HISTORY, CLICK)
+    assert cache.get("task", "http://0/", "00ff", HISTORY) is None
+    assert cache.get("task", "http://2/", "00ff", HISTORY) == CLICK
+    cache.clear()
+    assert cache.get("task", "http://2/", "00ff", HISTORY) is None
@@ -0,0 +1,57 @@
+import json
+import pytest
+from stream_parser import ActionParser
+
+def feed(text, size):
+    parser = ActionParser()
+    events = []
+    for start in range(0, len(text), size):
+        events += parser.feed(text[start:start + size])
+    return events
+
+REPLY = {
+    "thought": 'Say "hi" {not json} [x]',
+    "actions": [
+        {"action": "type", "params": ['a "quoted" } ] text', 1, 2]},
+        {"action": "click", "params": [3, 4]},
+    ],
+}
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_events_do_not_depend_on_chunk_boundaries(size):
+    assert feed(json.dumps(REPLY), size) == [
+        ("thought", REPLY["thought"]),
+        ("action", REPLY["actions"][0]),
+        ("action", REPLY["actions"][1]),
+    ]
+
+def test_each_action_is_emitted_when_its_brace_closes():
+    parser = ActionParser()
+    assert parser.feed('{"thought": "t", "actions": [{"action": "click", "params": [1, 2]') == [("thought", "t")]
+    assert parser.feed("}") == [("action", {"action": "click", "params": [1, 2]})]
+    assert parser.feed(', {"action": "wait"') == []
+
+def test_escaped_backslashes_and_quotes():
+    text = r'{"thought": "ends in \\", "actions": [{"action": "type", "params": ["\\\"", 5, 6]}]}'
+    assert feed(text, 1) == [("thought", "ends in \\"), ("action", {"action": "type", "params": ['\\"', 5, 6]})]
+
+def test_nested_actions_keys_are_not_top_level_actions():
+    reply = {
+        "thought": "actions",
+        "note": {"actions": [{"action": "inner"}]},
+        "actions": [{"action": "click", "params": [1, 2], "meta": {"actions": [{"action": "bad"}]}}],
+    }
+    assert feed(json.dumps(reply), 3) == [("thought", "actions"), ("action", reply["actions"][0])]
+
+def test_key_order_and_fences():
+    text = '```json\n{"actions": [{"action": "wait", "params": []}], "thought": "late"}\n```'
+    assert feed(text, 4) == [("action", {"action": "wait", "params": []}), ("thought", "late")]
+
+def test_malformed_items_are_skipped_and_text_kept():
+    text = '{"thought": "t", "actions": [{"action": "click", "params": [1,]}, {"action": "wait", "params": []}]}'
+    parser = ActionParser()
+    assert parser.feed(text) == [("thought", "t"), ("action", {"action": "wait", "params": []})]
+    assert parser.text == text
+
+def test_truncated_reply_emits_only_complete_items():
+    assert feed('{"thought": "x", "actions": [{"action": "click", "params": [1,', 5) == [("thought", "x")]
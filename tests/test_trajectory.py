@@ -0,0 +1,78 @@
+import os
+import time
+from trajectory import TrajectoryStore, checkpoint_matches, final_answer, task_key
+
+THUMB = "80" * 64 * 36
+
+def with_cells(thumb, cells, value="ff"):
+    """The thumbprint with the first `cells` cells set to `value`."""
+    return value * cells + thumb[2 * cells:]
+
+def checkpoint(url="http://a/", frame=THUMB, dom=None):
+    return {"url": url, "frame": frame, "dom": dom}
+
+def test_task_key_normalizes_case_and_whitespace():
+    assert task_key("Find  the PRICE\n", "http://a/") == task_key("find the price", "http://a/")
+    assert task_key("find the price", "http://a/") != task_key("find the price", "http://b/")
+
+def test_checkpoint_needs_the_same_url():
+    assert checkpoint_matches(checkpoint(), checkpoint())
+    assert not checkpoint_matches(checkpoint(), checkpoint(url="http://a/other"))
+    assert not checkpoint_matches(checkpoint(url=None), checkpoint(url=None))
+
+def test_checkpoint_tolerates_one_changed_cell():
+    assert checkpoint_matches(checkpoint(), checkpoint(frame=with_cells(THUMB, 1)))
+    assert not checkpoint_matches(checkpoint(), checkpoint(frame=with_cells(THUMB, 2)))
+    # Small brightness shifts (e.g. compression noise) are not changes
+    assert checkpoint_matches(checkpoint(), checkpoint(frame=with_cells(THUMB, 100, "88")))
+
+def test_checkpoint_without_comparable_frames_never_matches():
+    assert not checkpoint_matches(checkpoint(), checkpoint(frame=None))
+    assert not checkpoint_matches(checkpoint(), checkpoint(frame="80" * 16))
+
+def test_checkpoint_dom_must_match_when_both_have_one():
+    assert checkpoint_matches(checkpoint(dom="abc"), checkpoint(dom="abc"))
+    assert not checkpoint_matches(checkpoint(dom="abc"), checkpoint(dom="abd"))
+    assert checkpoint_matches(checkpoint(dom="abc"), checkpoint())
+
+def test_final_answer():
+    assert final_answer({"actions": [{"action": "scroll", "params": ["down"]}, {"action": "finish", "params": ["$10"]}]})
+    assert not final_answer({"actions": [{"action": "finish", "params": []}]})
+    assert not final_answer({"actions": [{"action": "click", "params": [1, 2]}]})
+    assert not final_answer({})
+
+def test_save_and_load(tmp_path):
+    store = TrajectoryStore(str(tmp_path))
+    steps = [{"checkpoint": checkpoint(), "response": {"thought": "t", "actions": []}}]
+    store.save("Find the price", "http://a/", steps)
+    loaded = store.load("find the  price", "http://a/")
+    assert loaded["steps"] == steps
+    assert store.load("find the price", "http://b/") is None
+
+def test_load_ignores_corrupt_files(tmp_path):
+    store = TrajectoryStore(str(tmp_path))
+    with open(os.path.join(tmp_path, f"{task_key('task', 'http://a/')}.json"), "w") as f:
+        f.write("{")
+    assert store.load("task", "http://a/") is None
+
+def test_evicts_least_recently_used_beyond_max_entries(tmp_path):
+    store = TrajectoryStore(str(tmp_path), max_entries=2)
+    now = time.time()
+    for i, task in enumerate(("a", "b")):
+        store.save(task, "http://a/", [])
+        path = os.path.join(tmp_path, f"{task_key(task, 'http://a/')}.json")
+        os.utime(path, (now - 100 + i, now - 100 + i))
+    store.load("a", "http://a/") # Now the most recently used
+    store.save("c", "http://a/", [])
+    assert store.load("a", "http://a/") is not None
+    assert store.load("b", "http://a/") is None
+    assert store.load("c", "http://a/") is not None
+
+def test_evicts_entries_older_than_max_age(tmp_path):
+    store = TrajectoryStore(str(tmp_path), max_age_days=1)
+    store.save("old", "http://a/", [])
+    old = time.time() - 2 * 86400
+    os.utime(os.path.join(tmp_path, f"{task_key('old', 'http://a/')}.json"), (old, old))
+    store.save("new", "http://a/", [])
+    assert store.load("old", "http://a/") is None
+    assert store.load("new", "http://a/") is not None
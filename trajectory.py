@@ -0,0 +1,89 @@
+import os
+import json
+import time
+import hashlib
+from utils import thumbprint_changes
+
+def task_key(task, start_url):
+    """Trajectories match on the normalized task text and the page the run starts from."""
+    normalized = " ".join(task.lower().split())
+    return hashlib.sha1(f"{normalized}\n{start_url}".encode()).hexdigest()[:20]
+
+def checkpoint_matches(recorded, current, max_changes=1):
+    """
+    True if the page looks the way it did when the step was recorded.
+
+    The URL must be the same and at most `max_changes` cells of the frame
+    thumbprints may differ, which tolerates a blinking cursor or a clock
+    but not typed text or a new error line. When both runs have a DOM
+    signature it must be equal too; on its own it can't tell pages apart,
+    since it ignores input values and plain text.
+    """
+    if not recorded.get("url") or recorded["url"] != current.get("url"):
+        return False
+    if recorded.get("dom") and current.get("dom") and recorded["dom"] != current["dom"]:
+        return False
+    changes = thumbprint_changes(recorded.get("frame"), current.get("frame"))
+    return changes is not None and changes <= max_changes
+
+def final_answer(response):
+    """True if the response ends the run with finish(answer)."""
+    return any(act.get("action") == "finish" and act.get("params") for act in response.get("actions", []))
+
+class TrajectoryStore:
+    """
+    Successful runs on disk, one JSON file per (task, start URL).
+
+    Each step holds the checkpoint seen before the decision (URL, frame
+    thumbprint and, in dom/hybrid perception, a DOM signature) and the
+    response that was acted on. Loading a trajectory marks it as recently used; saving evicts
+    files older than `max_age_days` and then the least recently used ones
+    beyond `max_entries`. Files are replaced atomically, so agents sharing
+    the directory never read a partial write.
+    """
+    def __init__(self, root, max_entries=200, max_age_days=30):
+        self.root = root
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.json")
+
+    def load(self, task, start_url):
+        path = self._path(task_key(task, start_url))
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                trajectory = json.load(f)
+            os.utime(path) # Recently used, evicted last
+        except (OSError, ValueError):
+            return None
+        return trajectory
+
+    def save(self, task, start_url, steps):
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(task_key(task, start_url))
+        trajectory = {"task": task, "start_url": start_url, "recorded": time.time(), "steps": steps}
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(trajectory, f)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        entries.sort(reverse=True)
+        cutoff = time.time() - self.max_age
+        for i, (mtime, path) in enumerate(entries):
+            if i >= self.max_entries or mtime < cutoff:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
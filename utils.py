@@ -1,44 +1,32 @@
 from PIL import Image, ImageDraw, ImageFont
 import io
 import base64
+import functools
 
-def resize_image(image_bytes, max_width=1024):
-    """Resizes an image to a maximum width while maintaining aspect ratio."""
-    img = Image.open(io.BytesIO(image_bytes))
-    w, h = img.size
-    if w > max_width:
-        ratio = max_width / w
-        new_size = (int(w * ratio), int(h * ratio))
-        img = img.resize(new_size, Image.LANCZOS)
-    
-    output = io.BytesIO()
-    img.save(output, format="JPEG", quality=80)
-    return output.getvalue()
-
-def add_grid(image_bytes):
-    """Adds a 10x10 numbered grid to the image to help the LLM with coordinates."""
-    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    draw = ImageDraw.Draw(img)
-    w, h = img.size
-    
-    # Try to load a larger font, fallback to default
+@functools.lru_cache(maxsize=1)
+def get_font():
+    """Loads the grid label font once per process."""
     try:
         # On Windows, arial.ttf is usually present
-        font = ImageFont.truetype("arial.ttf", 20)
+        return ImageFont.truetype("arial.ttf", 20)
     except:
-        font = ImageFont.load_default()
+        return ImageFont.load_default()
+
+@functools.lru_cache(maxsize=8)
+def grid_overlay(size):
+    """Builds the transparent 10x10 grid layer for a frame size (cached per size)."""
+    w, h = size
+    layer = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(layer)
+    font = get_font()
 
-    # Draw grid lines and numbers
     for i in range(11):
         x = (i * w) // 10
         y = (i * h) // 10
-        
-        # Vertical lines
+
         draw.line([(x, 0), (x, h)], fill="red", width=1)
-        # Horizontal lines
         draw.line([(0, y), (w, y)], fill="red", width=1)
-        
-        # Add coordinate numbers with a shadow/outline for readability
+
         if i < 10:
             text = str(i * 100)
             for offset in [(1,1), (-1,-1), (1,-1), (-1,1)]:
@@ -47,26 +35,115 @@ def add_grid(image_bytes):
             draw.text((x + 2, 2), text, fill="red", font=font)
             draw.text((2, y + 2), text, fill="red", font=font)
 
-    output = io.BytesIO()
-    img.save(output, format="JPEG", quality=80)
-    return output.getvalue()
+    return layer
 
-def mark_click(image_bytes, x_pct, y_pct):
-    """Draws a green dot at the specified 0-1000 coordinate for debugging."""
-    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    draw = ImageDraw.Draw(img)
-    w, h = img.size
-    
-    x = (x_pct * w) // 1000
-    y = (y_pct * h) // 1000
-    
-    radius = 10
-    draw.ellipse([(x - radius, y - radius), (x + radius, y + radius)], fill="lime", outline="black")
-    
+def encode_jpeg(img, quality=80):
     output = io.BytesIO()
-    img.save(output, format="JPEG", quality=80)
+    img.save(output, format="JPEG", quality=quality)
     return output.getvalue()
 
+def thumbprint_changes(a, b, threshold=16):
+    """Number of thumbnail cells whose brightness differs by more than `threshold`, or None if incomparable."""
+    if not a or not b or len(a) != len(b):
+        return None
+    a, b = bytes.fromhex(a), bytes.fromhex(b)
+    return sum(abs(x - y) > threshold for x, y in zip(a, b))
+
+class Frame:
+    """
+    A screenshot decoded once and kept in memory at model resolution.
+
+    The plain, grid and click-marked views are all rendered from the same
+    pixels and each is JPEG-encoded exactly once, so there is no generation
+    loss between them. Only the resized pixels are kept; sharper zoomed views
+    come from a separate capture of the region (see closeup()).
+    """
+    def __init__(self, image_bytes, max_width=1024, quality=80):
+        self._setup(Image.open(io.BytesIO(image_bytes)).convert("RGB"), max_width, quality)
+
+    @classmethod
+    def from_image(cls, img, max_width=1024, quality=80):
+        frame = cls.__new__(cls)
+        frame._setup(img, max_width, quality)
+        return frame
+
+    def _setup(self, img, max_width, quality):
+        w, h = img.size
+        if w > max_width:
+            ratio = max_width / w
+            img = img.resize((int(w * ratio), int(h * ratio)), Image.LANCZOS)
+        self.image = img
+        self.quality = quality
+        self._jpeg = None
+        self._grid_jpeg = None
+        self._thumbprint = None
+
+    def crop(self, box, width=768, quality=85):
+        """
+        A new Frame of the (x0, y0, x1, y1) region, in 0-1000 units, cut from
+        the resized frame and scaled to `width` pixels so its own grid stays
+        readable.
+        """
+        w, h = self.size
+        x0, y0, x1, y1 = box
+        region = self.image.crop(((x0 * w) // 1000, (y0 * h) // 1000, (x1 * w) // 1000, (y1 * h) // 1000))
+        return Frame._scaled(region, width, quality)
+
+    @classmethod
+    def closeup(cls, image_bytes, width=768, quality=85):
+        """A Frame of a separately captured region (e.g. a clipped screenshot), scaled to `width` pixels."""
+        return cls._scaled(Image.open(io.BytesIO(image_bytes)).convert("RGB"), width, quality)
+
+    @classmethod
+    def _scaled(cls, region, width, quality):
+        rw, rh = region.size
+        region = region.resize((width, max(1, rh * width // rw)), Image.LANCZOS)
+        return cls.from_image(region, width, quality)
+
+    @property
+    def size(self):
+        return self.image.size
+
+    @property
+    def jpeg(self):
+        """The resized frame without overlays."""
+        if self._jpeg is None:
+            self._jpeg = encode_jpeg(self.image, self.quality)
+        return self._jpeg
+
+    @property
+    def grid_jpeg(self):
+        """The frame with the coordinate grid, as sent to the model."""
+        if self._grid_jpeg is None:
+            img = self.image.convert("RGBA")
+            img.alpha_composite(grid_overlay(self.size))
+            self._grid_jpeg = encode_jpeg(img.convert("RGB"), self.quality)
+        return self._grid_jpeg
+
+    def thumbprint(self):
+        """
+        The frame as a 64x36 grayscale thumbnail, as hex. Unlike a
+        perceptual hash, which only keeps gradient signs, it changes when a
+        line of text appears, e.g. typed input or an error message (see
+        thumbprint_changes).
+        """
+        if self._thumbprint is None:
+            self._thumbprint = self.image.convert("L").resize((64, 36), Image.BOX).tobytes().hex()
+        return self._thumbprint
+
+    def mark_click(self, x_pct, y_pct):
+        """Draws a green dot at the specified 0-1000 coordinate for debugging."""
+        img = self.image.copy()
+        draw = ImageDraw.Draw(img)
+        w, h = img.size
+
+        x = (x_pct * w) // 1000
+        y = (y_pct * h) // 1000
+
+        radius = 10
+        draw.ellipse([(x - radius, y - radius), (x + radius, y + radius)], fill="lime", outline="black")
+        return encode_jpeg(img, self.quality)
+
 SYSTEM_PROMPT = """
 You are a web agent that navigates the web using screenshots. 
 You will receive a screenshot with a RED GRID overlay (numbered 0-1000).
@@ -77,8 +154,8 @@ ACTIONS:
 2. type(text, x, y): Click at (x, y) and type text.
 3. paste(text, x, y): Click at (x, y) and PASTE text (faster for long strings).
 4. scroll(direction): 'up' or 'down'.
-5. wait(): Wait 2s.
-6. finish(): Task is complete.
+5. wait(): Wait for the page to finish loading.
+6. finish(answer): Task is complete. answer is optional: what you found, if the task asks for something.
 7. ask_user(reason): Pause for user input.
 
 PRECISION RULES:
@@ -92,3 +169,41 @@ JSON FORMAT:
   "actions": [{"action": "click", "params": [450, 210]}]
 }
 """
+
+# Appended to SYSTEM_PROMPT in the "dom" and "hybrid" perception modes
+DOM_RULES = """
+ELEMENTS:
+- You also get an ELEMENTS list of the interactive elements on screen, one per
+  line: id, role, name and (x, y) center on the 0-1000 scale.
+- Prefer targeting elements by id: click(id), type(text, id), paste(text, id),
+  e.g. {"action": "click", "params": [12]}.
+- Only fall back to (x, y) coordinates for things missing from the list.
+"""
+
+# Appended to SYSTEM_PROMPT when the agent may fan out into parallel tabs
+FAN_OUT_RULES = """
+PARALLEL TABS:
+8. split(subtask, subtask, ...): Run independent parts of the task at the same time, each in its own tab.
+- Use it when the task repeats the same work over several sites or items,
+  e.g. comparing a price across shops. Only split parts that don't depend on each other.
+- Start a subtask with a URL to open it there, e.g.
+  "https://shop.example.com find the price of the 'Desk Lamp 40W'";
+  otherwise the tab opens on the current page.
+- Each tab ends with finish(answer); the answers come back in your History.
+"""
+
+# Appended to SYSTEM_PROMPT when zoom refinement is enabled
+ZOOM_RULES = """
+ZOOM:
+- If a click/type/paste target is small or you are unsure of its exact position,
+  add "zoom": true and a short "target" description to that action, e.g.
+  {"action": "click", "params": [450, 210], "zoom": true, "target": "the 'Next' link"}.
+  You will then get a close-up of that area to refine the coordinates.
+"""
+
+ZOOM_PROMPT = """
+This is a close-up of part of the previous screenshot, with its own RED GRID
+(0-1000 across the close-up only). Find: {target}
+Respond in JSON with the precise point to click inside this close-up:
+{{"x": 500, "y": 500}}
+"""